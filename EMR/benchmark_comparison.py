@@ -0,0 +1,400 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pika
+
+from mock_api import add_server_arguments, server_from_args, start_in_thread
+
+MQ_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Mq')
+sys.path.insert(0, MQ_DIR)
+from Producer.producer import ConfirmedPublisher, iter_messages
+from common.metrics import scrape_counters
+from common.retry import RetryPolicy
+
+# Consumer runtimes driven by the benchmark (see mq_environment for their
+# settings) and what processing means for each. worker.py and the batch worker simulate their
+# work in-process; the async worker posts every ID to the mock endpoint, as
+# processor.py does on the EMR side.
+MQ_MODES = {
+    'serial': 'Consumer.worker',
+    'pool': 'Consumer.worker',
+    'batch': 'Consumer_batch.worker',
+    'async': 'Consumer.async_worker',
+}
+PROCESSING = {
+    'serial': 'simulated 10 ms per message',
+    'pool': 'simulated 10 ms per message',
+    'batch': 'simulated 10 ms per batch',
+    'async': 'mock endpoint',
+    'spark': 'mock endpoint',
+}
+# The batch worker's simulated work is 10 ms per batch, not per ID, so it is
+# left out when picking the fastest configuration of each system
+LIKE_FOR_LIKE = {'serial', 'pool', 'async', 'spark'}
+SETTLED_METRICS = ('mq_messages_acked_total', 'mq_messages_dead_lettered_total')
+COLUMNS = ['system', 'mode', 'processes', 'concurrency', 'ids', 'status', 'seconds', 'ids_per_second',
+           'publish_seconds', 'startup_seconds', 'p50_ms', 'p99_ms', 'processing', 'note']
+
+BEGIN_MARKER = '<!-- BEGIN MEASURED RESULTS -->'
+END_MARKER = '<!-- END MEASURED RESULTS -->'
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_port(host, port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing is listening on {host}:{port}")
+
+def start_mock_broker():
+    """Run mock_broker.py in its own process (so it does not share our GIL) and return (process, port)"""
+    port = free_port()
+    process = subprocess.Popen([sys.executable, 'mock_broker.py', '--port', str(port)], cwd=MQ_DIR,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port('127.0.0.1', port)
+    return process, port
+
+def stop(processes, timeout=15):
+    """SIGTERM the processes (the workers' graceful shutdown), then kill stragglers"""
+    for process in processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        try:
+            process.wait(timeout=max(0.1, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def settled_count(urls):
+    """Acked plus dead-lettered messages across the workers' /metrics endpoints"""
+    return int(scrape_counters(urls, SETTLED_METRICS, timeout=2) or 0)
+
+def mq_concurrency(args, mode):
+    """In-process concurrency of one consumer process"""
+    if mode == 'pool':
+        return args.pool_size
+    if mode == 'async':
+        return args.max_concurrency
+    if mode == 'batch':
+        return args.batch_size
+    return 1
+
+def mq_environment(args, mode, queue, host, port, metrics_port, api_url):
+    env = {
+        **os.environ,
+        'MQ_HOST': host,
+        'MQ_PORT': str(port),
+        'MQ_TLS': 'false',
+        'USERNAME': args.mq_user,
+        'PASSWORD': args.mq_password,
+        'QUEUE_NAME': queue,
+        'LOG_LEVEL': 'WARNING',
+        'METRICS_INTERVAL': '0',
+        'METRICS_PORT': str(metrics_port),
+    }
+    if mode == 'pool':
+        env['WORKER_POOL_SIZE'] = str(args.pool_size)
+    elif mode == 'batch':
+        env.update({'BATCH_SIZE': str(args.batch_size), 'DRAIN_POLICY': 'never'})
+    elif mode == 'async':
+        env.update({'MAX_CONCURRENCY': str(args.max_concurrency), 'API_GATEWAY_URL': api_url})
+    return env
+
+def wait_for_consumers(channel, queue, consumers, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if channel.queue_declare(queue=queue, passive=True).method.consumer_count >= consumers:
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"{consumers} consumer(s) did not subscribe to {queue} within {timeout}s")
+
+def delete_queues(channel, queue):
+    """Remove the run's work, retry and dead-letter queues (they are durable on RabbitMQ)"""
+    policy = RetryPolicy(queue)
+    for name in [queue, policy.dead_letter_queue] + [policy.retry_queue(n) for n in range(1, policy.max_retries + 1)]:
+        channel.queue_delete(queue=name)
+
+def run_mq(args, parameters, mode, processes, ids, api_url, run_number):
+    """Time `ids` IDs from the first publish until the last one is settled.
+
+    The consumers are started and subscribed first, so their start-up is
+    not counted; publishing overlaps with consuming, as it does in
+    production. Each run uses its own queue.
+    """
+    queue = f"benchmark.{run_number}.{mode}.{processes}.{ids}"
+    row = {'system': 'mq', 'mode': mode, 'processes': processes, 'concurrency': mq_concurrency(args, mode),
+           'ids': ids, 'processing': PROCESSING[mode]}
+    connection = pika.BlockingConnection(parameters)
+    channel = connection.channel()
+    channel.queue_declare(queue=queue, durable=True)
+    env = mq_environment(args, mode, queue, parameters.host, parameters.port, args.metrics_port, api_url)
+    workers = [
+        subprocess.Popen([sys.executable, '-m', MQ_MODES[mode]], cwd=MQ_DIR, env={**env, 'WORKER_INDEX': str(i)},
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for i in range(processes)
+    ]
+    urls = [f"http://127.0.0.1:{args.metrics_port + i}/metrics" for i in range(processes)]
+    try:
+        wait_for_consumers(channel, queue, processes, timeout=30)
+        started = time.perf_counter()
+        publisher = ConfirmedPublisher(parameters, queue, iter_messages(0, ids, 1))
+        publisher.run()
+        row['publish_seconds'] = round(time.perf_counter() - started, 3)
+        deadline = started + args.timeout
+        settled = settled_count(urls)
+        while settled < ids and time.perf_counter() < deadline:
+            connection.sleep(0.05)
+            settled = settled_count(urls)
+        elapsed = time.perf_counter() - started
+        row.update({
+            'status': 'ok' if settled >= ids else 'timeout',
+            'seconds': round(elapsed, 3),
+            'ids_per_second': round(settled / elapsed, 1),
+        })
+        if settled < ids:
+            row['note'] = f"{settled} of {ids} settled"
+    finally:
+        stop(workers)
+        delete_queues(channel, queue)
+        connection.close()
+    return row
+
+def run_emr(args, api_url):
+    """processor.py through local-mode Spark for every ID count and max_in_flight.
+
+    Returns skipped rows when pyspark (or a JVM) is not available.
+    """
+    combinations = [(ids, max_in_flight) for ids in args.ids for max_in_flight in args.max_in_flight]
+    try:
+        from benchmark_processor import create_local_spark, run_benchmark
+    except ImportError as e:
+        print(f"Skipping the EMR runs: {e}")
+        return [emr_row(ids, max_in_flight, args.partitions, status='skipped', note=f"import failed: {e}")
+                for ids, max_in_flight in combinations]
+
+    log_dir = tempfile.mkdtemp(prefix='comparison_benchmark_logs_')
+    started = time.perf_counter()
+    try:
+        spark = create_local_spark(args.cores, api_url, log_dir)
+    except Exception as e:
+        print(f"Skipping the EMR runs, Spark did not start: {e}")
+        return [emr_row(ids, max_in_flight, args.partitions, status='skipped', note=f"Spark did not start: {e}")
+                for ids, max_in_flight in combinations]
+    startup_seconds = round(time.perf_counter() - started, 3)
+    rows = []
+    try:
+        for ids, max_in_flight in combinations:
+            summary = run_benchmark(spark, ids, args.partitions, {'max_in_flight': max_in_flight, 'progress_interval': 0})
+            rows.append(emr_row(
+                ids, max_in_flight, args.partitions,
+                status='ok' if summary['processed'] == ids else 'incomplete',
+                seconds=summary['duration_seconds'],
+                ids_per_second=summary['throughput_per_second'],
+                startup_seconds=startup_seconds,
+                p50_ms=summary['latency_ms']['p50'],
+                p99_ms=summary['latency_ms']['p99'],
+                note=f"statuses {summary['status_counts']}",
+            ))
+            print_row(rows[-1])
+    finally:
+        spark.stop()
+    return rows
+
+def emr_row(ids, max_in_flight, partitions, **fields):
+    return {'system': 'emr', 'mode': 'spark', 'processes': partitions, 'concurrency': max_in_flight,
+            'ids': ids, 'processing': PROCESSING['spark'], **fields}
+
+def print_row(row):
+    if row.get('status') == 'ok':
+        print(f"{row['system']} {row['mode']} {row['processes']}x{row['concurrency']} ids={row['ids']}: "
+              f"{row['seconds']:.2f}s, {row['ids_per_second']:.1f} IDs/s")
+    else:
+        print(f"{row['system']} {row['mode']} {row['processes']}x{row['concurrency']} ids={row['ids']}: "
+              f"{row.get('status')} {row.get('note', '')}")
+
+def describe(row):
+    if row['system'] == 'emr':
+        return f"{row['processes']} partitions x {row['concurrency']} in flight"
+    if row['mode'] == 'serial':
+        return f"{row['processes']} consumer(s)"
+    unit = {'pool': 'threads', 'async': 'concurrent', 'batch': 'per batch'}[row['mode']]
+    return f"{row['processes']} consumer(s) x {row['concurrency']} {unit}"
+
+def format_value(value, digits=2):
+    if value is None:
+        return '-'
+    return f"{value:.{digits}f}" if isinstance(value, float) else str(value)
+
+def render_markdown(results):
+    """The measured section of comparison.md"""
+    settings = results['settings']
+    lines = [
+        BEGIN_MARKER,
+        '## Measured Results',
+        '',
+        f"Generated by `benchmark_comparison.py` on {results['generated_at']} ({results['environment']['platform']}, "
+        f"{results['environment']['cpus']} CPUs, Python {results['environment']['python']}). "
+        f"Broker: {settings['broker']}; mock endpoint latency: {settings['mock_latency']}. "
+        'MQ time runs from the first publish to the last ack with consumers already subscribed; '
+        'EMR time is the processing job in local-mode Spark, excluding session start-up '
+        '(listed separately in the notes).',
+        '',
+        '| System | Mode | Concurrency | IDs | Seconds | IDs/s | Processing | Notes |',
+        '|--------|------|-------------|-----|---------|-------|------------|-------|',
+    ]
+    for row in results['rows']:
+        notes = [row['note']] if row.get('note') else []
+        if row.get('startup_seconds') is not None:
+            notes.insert(0, f"Spark start-up {row['startup_seconds']:.1f}s")
+        if row.get('publish_seconds') is not None:
+            notes.insert(0, f"published in {row['publish_seconds']:.2f}s")
+        seconds = format_value(row.get('seconds')) if row['status'] == 'ok' else row['status']
+        lines.append(f"| {row['system'].upper()} | {row['mode']} | {describe(row)} | {row['ids']} | {seconds} | "
+                     f"{format_value(row.get('ids_per_second'), 1)} | {row['processing']} | {'; '.join(notes)} |")
+
+    lines += ['', 'Fastest measured configuration per ID count (10 ms of work per ID; the batch mode is excluded):', '']
+    for ids in sorted({row['ids'] for row in results['rows']}):
+        for system in ('mq', 'emr'):
+            measured = [row for row in results['rows']
+                        if row['system'] == system and row['ids'] == ids and row['status'] == 'ok'
+                        and row['mode'] in LIKE_FOR_LIKE]
+            if measured:
+                best = min(measured, key=lambda row: row['seconds'])
+                lines.append(f"- {ids} IDs, {system.upper()}: {best['seconds']:.2f}s "
+                             f"({best['mode']}, {describe(best)})")
+            else:
+                lines.append(f"- {ids} IDs, {system.upper()}: not measured")
+    lines.append(END_MARKER)
+    return '\n'.join(lines) + '\n'
+
+def update_comparison(path, section):
+    """Replace the measured section of the comparison document (appended if it has none)"""
+    with open(path) as f:
+        text = f.read()
+    if BEGIN_MARKER in text and END_MARKER in text:
+        before, rest = text.split(BEGIN_MARKER, 1)
+        after = rest.split(END_MARKER, 1)[1].lstrip('\n')
+        text = before + section + ('\n' + after if after else '')
+    else:
+        text = text.rstrip('\n') + '\n\n' + section
+    with open(path, 'w') as f:
+        f.write(text)
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the MQ consumers against processor.py on local stand-ins")
+    parser.add_argument('--ids', type=int, nargs='+', default=[1000, 10000], help='ID counts to run')
+    parser.add_argument('--mq-modes', nargs='+', choices=list(MQ_MODES), default=list(MQ_MODES),
+                        help='Consumer runtimes to run')
+    parser.add_argument('--consumers', type=int, nargs='+', default=[1, 5],
+                        help='Consumer process counts to run (5 is one ECS task)')
+    parser.add_argument('--pool-size', type=int, default=16, help='WORKER_POOL_SIZE for the pool mode')
+    parser.add_argument('--max-concurrency', type=int, default=100, help='MAX_CONCURRENCY for the async mode')
+    parser.add_argument('--batch-size', type=int, default=100, help='BATCH_SIZE for the batch mode')
+    parser.add_argument('--max-in-flight', type=int, nargs='+', default=[16, 64],
+                        help='processor.py per-partition concurrency levels to run')
+    parser.add_argument('--partitions', type=int, default=4, help='Spark partitions per run')
+    parser.add_argument('--cores', type=int, default=4, help='Local Spark cores')
+    parser.add_argument('--mq-host', help='Use this broker (e.g. a rabbitmq:3 container) instead of mock_broker.py')
+    parser.add_argument('--mq-port', type=int, default=5672)
+    parser.add_argument('--mq-user', default='guest')
+    parser.add_argument('--mq-password', default='guest')
+    parser.add_argument('--metrics-port', type=int, default=9400,
+                        help='First of the consecutive ports the consumers serve /metrics on')
+    parser.add_argument('--timeout', type=float, default=600, help='Give up on an MQ run after this many seconds')
+    parser.add_argument('--skip-mq', action='store_true')
+    parser.add_argument('--skip-emr', action='store_true')
+    parser.add_argument('--output', default='comparison_results.json', help='Where to write the JSON results')
+    parser.add_argument('--csv', help='Also write the results table as CSV')
+    parser.add_argument('--comparison', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'comparison.md'),
+                        help='Comparison document whose Measured Results section is regenerated')
+    parser.add_argument('--no-update', action='store_true', help='Leave the comparison document untouched')
+    add_server_arguments(parser)
+    # Both sides see the 10 ms per ID the simulated MQ workers use
+    parser.set_defaults(latency_ms=10.0)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    server = server_from_args(args)
+    api_url = start_in_thread(server)
+    broker = None
+    if args.mq_host:
+        host, port = args.mq_host, args.mq_port
+        broker_description = f"{host}:{port}"
+    elif not args.skip_mq:
+        broker, port = start_mock_broker()
+        host = '127.0.0.1'
+        broker_description = 'mock_broker.py'
+    print(f"Mock endpoint: {api_url}")
+
+    rows = []
+    try:
+        if not args.skip_mq:
+            parameters = pika.ConnectionParameters(host=host, port=port,
+                                                   credentials=pika.PlainCredentials(args.mq_user, args.mq_password))
+            print(f"Broker: {broker_description}")
+            run_number = int(time.time())
+            for ids in args.ids:
+                for mode in args.mq_modes:
+                    for processes in args.consumers:
+                        rows.append(run_mq(args, parameters, mode, processes, ids, api_url, run_number))
+                        print_row(rows[-1])
+        if not args.skip_emr:
+            rows.extend(run_emr(args, api_url))
+    finally:
+        if broker is not None:
+            stop([broker])
+
+    results = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': {'platform': platform.platform(), 'cpus': os.cpu_count(), 'python': platform.python_version()},
+        'settings': {
+            'broker': None if args.skip_mq else broker_description,
+            'mock_latency': f"{args.latency_dist} {args.latency_ms:g} ms",
+            'pool_size': args.pool_size,
+            'max_concurrency': args.max_concurrency,
+            'batch_size': args.batch_size,
+            'partitions': args.partitions,
+            'cores': args.cores,
+        },
+        'mock_server_responses': {str(status): count for status, count in server.responses.items()},
+        'rows': [{column: row.get(column) for column in COLUMNS} for row in rows],
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.csv:
+        write_csv(args.csv, results['rows'])
+        print(f"Table written to {args.csv}")
+    if not args.no_update:
+        update_comparison(args.comparison, render_markdown(results))
+        print(f"Measured Results section of {args.comparison} regenerated")
+
+if __name__ == "__main__":
+    main()
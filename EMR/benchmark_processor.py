@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import tempfile
+from datetime import datetime
+from functools import partial
+
+from pyspark.sql import SparkSession
+
+import processor
+from mock_api import add_server_arguments, server_from_args, start_in_thread
+
+def run_benchmark(spark, ids=1000, partitions=4, settings_overrides=None):
+    """Run processor.process_batch over `ids` generated IDs.
+
+    Returns the processor's run summary (counts, throughput, latency
+    percentiles) plus a breakdown of result statuses.
+    """
+    settings = processor.load_settings(spark)
+    settings.update(settings_overrides or {})
+    stats = processor.ProcessorStats(spark.sparkContext)
+    df = spark.range(0, ids, 1, partitions)
+
+    start_time = datetime.now()
+    results = spark.createDataFrame(
+        df.rdd.mapPartitions(partial(processor.process_batch, settings=settings, stats=stats, input_path='benchmark')),
+        processor.RESULT_SCHEMA
+    )
+    status_counts = {row['status']: row['count'] for row in results.groupBy('status').count().collect()}
+    summary = stats.summary(start_time)
+    summary.update({
+        'ids': ids,
+        'partitions': partitions,
+        'settings': settings,
+        'status_counts': status_counts,
+    })
+    return summary
+
+def create_local_spark(cores, api_url, log_dir):
+    """Local-mode Spark session whose Python workers post to the mock endpoint"""
+    # Python workers inherit the environment of the JVM, which inherits ours
+    os.environ['API_GATEWAY_URL'] = api_url
+    os.environ['LOG_LOCAL_DIR'] = log_dir
+    spark = SparkSession.builder \
+        .master(f"local[{cores}]") \
+        .appName("Risk Profile Processor Benchmark") \
+        .config("spark.ui.enabled", "false") \
+        .getOrCreate()
+    spark.sparkContext.addPyFile(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'processor.py'))
+    return spark
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark processor.py against a local mock endpoint")
+    parser.add_argument('--ids', type=int, nargs='+', default=[1000], help='ID counts to run')
+    parser.add_argument('--max-in-flight', type=int, nargs='+', default=[64],
+                        help='Per-partition concurrency levels to run')
+    parser.add_argument('--partitions', type=int, default=4, help='Spark partitions per run')
+    parser.add_argument('--cores', type=int, default=4, help='Local Spark cores')
+    parser.add_argument('--output', default='processor_benchmark.json', help='Where to write the JSON results')
+    add_server_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    server = server_from_args(args)
+    api_url = start_in_thread(server)
+    log_dir = tempfile.mkdtemp(prefix='processor_benchmark_logs_')
+    print(f"Mock endpoint: {api_url}; batch logs in {log_dir}")
+
+    spark = create_local_spark(args.cores, api_url, log_dir)
+    runs = []
+    try:
+        for ids in args.ids:
+            for max_in_flight in args.max_in_flight:
+                summary = run_benchmark(
+                    spark, ids, args.partitions,
+                    {'max_in_flight': max_in_flight, 'progress_interval': 0}
+                )
+                runs.append(summary)
+                latency = summary['latency_ms']
+                print(f"ids={ids} max_in_flight={max_in_flight}: {summary['duration_seconds']:.2f}s, "
+                      f"{summary['throughput_per_second']:.1f} IDs/s, "
+                      f"p50 {latency['p50']:.0f} ms, p99 {latency['p99']:.0f} ms, "
+                      f"statuses {summary['status_counts']}")
+    finally:
+        spark.stop()
+
+    results = {
+        'mock_server': {
+            'latency_dist': args.latency_dist,
+            'latency_ms': args.latency_ms,
+            'error_rate': args.error_rate,
+            'throttle_rate': args.throttle_rate,
+            'responses': {str(status): count for status, count in server.responses.items()},
+        },
+        'runs': runs,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
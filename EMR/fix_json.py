@@ -1,33 +1,109 @@
+import argparse
+import codecs
 import json
 import boto3
 import re
 
-def fix_json_file():
+from s3_multipart import DEFAULT_PART_SIZE, MultipartUploader
+
+ID_PATTERN = re.compile(r'"id":\s*(\d+)')
+
+# Characters kept from the end of a chunk when no match ends there, so a match
+# split across a chunk boundary is found once the next chunk arrives
+CARRY_OVER = 1024
+
+def fix_json_file(bucket='ssn0212', key='input/customer_ids_20241202_190159.json',
+                  dest_key='input/fixed_customer_ids.json'):
     s3 = boto3.client('s3')
-    
+
     # Read the original file
-    response = s3.get_object(Bucket='ssn0212', Key='input/customer_ids_20241202_190159.json')
+    response = s3.get_object(Bucket=bucket, Key=key)
     content = response['Body'].read().decode('utf-8')
-    
+
     # Use regex to extract all IDs
-    id_matches = re.findall(r'"id":\s*(\d+)', content)
-    
+    id_matches = ID_PATTERN.findall(content)
+
     # Create JSON objects
     items = [{"id": int(id_val)} for id_val in id_matches]
-    
+
     # Write back as properly formatted JSON array
     fixed_content = json.dumps(items, indent=2)
-    
+
     print(f"Found {len(items)} items")
     print("First few items:", json.dumps(items[:5], indent=2))
-    
+
     # Upload the fixed file
     s3.put_object(
-        Bucket='ssn0212',
-        Key='input/fixed_customer_ids.json',
+        Bucket=bucket,
+        Key=dest_key,
         Body=fixed_content.encode('utf-8')
     )
     print("Fixed JSON file uploaded successfully")
 
+def iter_ids(chunks):
+    """Yield every ID matched in a stream of byte chunks.
+
+    A match is only accepted once text follows it, so an ID whose digits are
+    split across two chunks is not emitted truncated.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        last_end = 0
+        for match in ID_PATTERN.finditer(buffer):
+            if match.end() == len(buffer):
+                break
+            yield int(match.group(1))
+            last_end = match.end()
+        buffer = buffer[max(last_end, len(buffer) - CARRY_OVER):]
+    buffer += decoder.decode(b'', final=True)
+    for match in ID_PATTERN.finditer(buffer):
+        yield int(match.group(1))
+
+def fix_json_stream(bucket='ssn0212', key='input/customer_ids_20241202_190159.json',
+                    dest_key=None, chunk_size=1024 * 1024, part_size=DEFAULT_PART_SIZE):
+    """Repair a malformed ID file with constant memory.
+
+    The source object is read in chunks and the extracted IDs are written as
+    newline-delimited JSON through a multipart upload.
+    """
+    s3 = boto3.client('s3')
+    dest_key = dest_key or f"input/fixed_{key.rsplit('/', 1)[-1].split('.', 1)[0]}.jsonl"
+
+    response = s3.get_object(Bucket=bucket, Key=key)
+    count = 0
+    first_items = []
+    with MultipartUploader(s3, bucket, dest_key, part_size) as uploader:
+        lines = []
+        for id_val in iter_ids(response['Body'].iter_chunks(chunk_size)):
+            lines.append(f'{{"id": {id_val}}}\n')
+            if len(first_items) < 5:
+                first_items.append({"id": id_val})
+            if len(lines) >= 10000:
+                uploader.write(''.join(lines).encode('utf-8'))
+                lines = []
+            count += 1
+        if lines:
+            uploader.write(''.join(lines).encode('utf-8'))
+
+    print(f"Found {count} items")
+    print("First few items:", json.dumps(first_items, indent=2))
+    print(f"Fixed NDJSON file uploaded successfully to s3://{bucket}/{dest_key}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract IDs from a malformed JSON file in S3")
+    parser.add_argument('--bucket', default='ssn0212', help='Bucket holding the source and fixed files')
+    parser.add_argument('--key', default='input/customer_ids_20241202_190159.json', help='Source object key')
+    parser.add_argument('--dest-key', help='Fixed object key (default: input/fixed_<source name>.jsonl, '
+                                           'or input/fixed_customer_ids.json with --in-memory)')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='Read the whole file and write a JSON array (original behaviour)')
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    fix_json_file()
+    args = parse_args()
+    if args.in_memory:
+        fix_json_file(args.bucket, args.key, args.dest_key or 'input/fixed_customer_ids.json')
+    else:
+        fix_json_stream(args.bucket, args.key, args.dest_key)
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import json
+import random
+import threading
+from collections import Counter
+
+RESPONSE_MESSAGE = "Successfully processed"
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 429: 'Too Many Requests', 500: 'Internal Server Error'}
+
+class LatencyModel:
+    """Samples response latencies in seconds from a configurable distribution.
+
+    fixed:       always latency_ms
+    uniform:     between min_ms and max_ms
+    normal:      mean latency_ms, standard deviation stddev_ms
+    lognormal:   median latency_ms, shape sigma (long right tail)
+    exponential: mean latency_ms
+    Samples are clamped to [min_ms, max_ms] when those are set.
+    """
+    def __init__(self, distribution='fixed', latency_ms=100.0, stddev_ms=0.0, sigma=0.5,
+                 min_ms=None, max_ms=None):
+        self.distribution = distribution
+        self.latency_ms = latency_ms
+        self.stddev_ms = stddev_ms
+        self.sigma = sigma
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+
+    def sample(self):
+        if self.distribution == 'uniform':
+            value = random.uniform(self.min_ms or 0.0, self.max_ms or self.latency_ms)
+        elif self.distribution == 'normal':
+            value = random.gauss(self.latency_ms, self.stddev_ms)
+        elif self.distribution == 'lognormal':
+            value = random.lognormvariate(0, self.sigma) * self.latency_ms
+        elif self.distribution == 'exponential':
+            value = random.expovariate(1 / self.latency_ms) if self.latency_ms > 0 else 0.0
+        else:
+            value = self.latency_ms
+        if self.min_ms is not None:
+            value = max(value, self.min_ms)
+        if self.max_ms is not None:
+            value = min(value, self.max_ms)
+        return max(value, 0.0) / 1000
+
+class MockRiskProfileServer:
+    """asyncio stand-in for the API Gateway /risk-profile mock integration.
+
+    Responds like the gateway's response template after a sampled delay, and
+    injects 500s and 429s (with Retry-After) at the configured rates.
+    """
+    def __init__(self, latency=None, error_rate=0.0, throttle_rate=0.0, retry_after=1):
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.responses = Counter()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload, extra_headers = await self.respond(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                self.write_response(writer, status, payload, extra_headers, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method, path, body):
+        if method != 'POST' or path.split('?', 1)[0].rstrip('/') != '/risk-profile':
+            return 404, {"message": "Not Found"}, {}
+        await asyncio.sleep(self.latency.sample())
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return 429, {"message": "Too Many Requests"}, {'Retry-After': str(self.retry_after)}
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {"message": "Internal server error"}, {}
+        try:
+            risk_profile_id = json.loads(body)['risk_profile_id']
+        except (ValueError, KeyError, TypeError):
+            return 400, {"message": "Invalid request body"}, {}
+        return 200, {"message": RESPONSE_MESSAGE, "risk_profile_id": f"{risk_profile_id}"}, {}
+
+    def write_response(self, writer, status, payload, extra_headers, keep_alive):
+        self.responses[status] += 1
+        body = json.dumps(payload).encode('utf-8')
+        headers = {
+            'Content-Type': 'application/json',
+            'Content-Length': str(len(body)),
+            'Access-Control-Allow-Origin': '*',
+            'Connection': 'keep-alive' if keep_alive else 'close',
+            **extra_headers,
+        }
+        head = f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n" + \
+            ''.join(f"{name}: {value}\r\n" for name, value in headers.items()) + "\r\n"
+        writer.write(head.encode('latin-1') + body)
+
+    async def serve(self, host='127.0.0.1', port=8080, ready=None):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        if ready is not None:
+            ready(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+def start_in_thread(server, host='127.0.0.1', port=0):
+    """Run a MockRiskProfileServer on a daemon thread and return its URL.
+
+    Port 0 picks a free port.
+    """
+    bound = {}
+    started = threading.Event()
+
+    def ready(actual_port):
+        bound['port'] = actual_port
+        started.set()
+
+    thread = threading.Thread(target=lambda: asyncio.run(server.serve(host, port, ready)), daemon=True)
+    thread.start()
+    if not started.wait(timeout=10):
+        raise RuntimeError("Mock risk-profile server did not start")
+    return f"http://{host}:{bound['port']}/risk-profile"
+
+def add_server_arguments(parser):
+    """Mock server options, shared with the benchmark entry points"""
+    parser.add_argument('--latency-dist', default='fixed',
+                        choices=['fixed', 'uniform', 'normal', 'lognormal', 'exponential'],
+                        help='Response latency distribution')
+    parser.add_argument('--latency-ms', type=float, default=100.0,
+                        help='Fixed/mean/median latency in ms (the real gateway sleeps 10000)')
+    parser.add_argument('--latency-stddev-ms', type=float, default=0.0, help='Standard deviation for normal')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='Shape for lognormal')
+    parser.add_argument('--latency-min-ms', type=float, help='Lower clamp (and uniform minimum)')
+    parser.add_argument('--latency-max-ms', type=float, help='Upper clamp (and uniform maximum)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429s')
+
+def server_from_args(args):
+    latency = LatencyModel(
+        args.latency_dist, args.latency_ms, args.latency_stddev_ms, args.latency_sigma,
+        args.latency_min_ms, args.latency_max_ms
+    )
+    return MockRiskProfileServer(latency, args.error_rate, args.throttle_rate, args.retry_after)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local mock of the /risk-profile API Gateway endpoint")
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    add_server_arguments(parser)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = server_from_args(args)
+    print(f"Mock risk-profile endpoint on http://{args.host}:{args.port}/risk-profile "
+          f"({args.latency_dist} latency {args.latency_ms} ms, "
+          f"{args.error_rate:.1%} errors, {args.throttle_rate:.1%} throttled)")
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print(f"Stopped. Responses: {dict(server.responses)}")
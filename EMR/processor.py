@@ -1,12 +1,23 @@
+from pyspark import AccumulatorParam, TaskContext
 from pyspark.sql import SparkSession
+from pyspark.sql.types import DoubleType, IntegerType, LongType, StringType, StructField, StructType, TimestampType
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import bisect
 import logging
 import json
+import random
 import sys
+import tempfile
 import traceback
+import threading
+import uuid
 import boto3
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from datetime import datetime
+from functools import partial
 import time
 
 # Configure logging
@@ -19,13 +30,104 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def parse_bool(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+# Processor tuning settings. Each can be set with the upper-case environment
+# variable or the Spark conf spark.riskprofile.<name>, the Spark conf taking
+# precedence. HTTP fan-out and throttling limits apply per partition.
+PROCESSOR_SETTINGS = {
+    'fast_path': (parse_bool, False),     # explicit schema, no schema/sample/count jobs before processing
+    'target_partitions': (int, 0),        # repartition the input to this many partitions, 0 keeps the read layout
+    'max_in_flight': (int, 64),           # thread pool size and AIMD ceiling
+    'min_in_flight': (int, 1),            # AIMD floor
+    'initial_in_flight': (int, 0),        # AIMD starting point, 0 starts at max_in_flight
+    'rate_limit': (float, 0.0),           # requests per second, 0 disables the token bucket
+    'rate_burst': (int, 10),              # token bucket capacity
+    'max_retries': (int, 3),              # retries for 429/5xx and connection errors
+    'backoff_base': (float, 0.5),         # seconds, doubled per attempt before jitter
+    'backoff_cap': (float, 30.0),         # maximum backoff in seconds
+    'breaker_error_rate': (float, 0.5),   # error ratio that opens the circuit
+    'breaker_window': (int, 50),          # outcomes considered for the error ratio
+    'breaker_min_requests': (int, 20),    # outcomes needed before the circuit can open
+    'breaker_cooldown': (float, 30.0),    # seconds the partition pauses once open
+    'progress_interval': (float, 30.0),   # seconds between driver progress lines, 0 disables them
+}
+
+CONNECT_TIMEOUT = float(os.getenv('CONNECT_TIMEOUT', '5'))
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', '30'))
+
+# Streaming batch log settings
+S3_MIN_PART_SIZE = 5 * 1024 * 1024  # S3 rejects smaller non-final parts
+LOG_STREAMING = os.getenv('LOG_STREAMING', 'false').lower() == 'true'
+LOG_PART_SIZE = int(os.getenv('LOG_PART_SIZE', str(8 * 1024 * 1024)))
+LOG_SPILL_DIR = os.getenv('LOG_SPILL_DIR')  # None uses the system temp directory
+LOG_LOCAL_DIR = os.getenv('LOG_LOCAL_DIR')  # write batch logs to this local directory instead of S3
+
+# Structured per-ID results, written next to the text logs
+RESULTS_FORMAT = os.getenv('RESULTS_FORMAT', 'parquet')  # parquet or json (JSON lines)
+RESULTS_PATH = os.getenv('RESULTS_PATH')  # None derives a per-run path under logs/processor_results/
+SUMMARY_PATH = os.getenv('SUMMARY_PATH')  # None derives a per-run path under logs/processor_summaries/
+
+# Latency histogram bucket upper bounds: 10 log-spaced buckets per decade from
+# 1 ms to ~158 s, plus an overflow bucket
+LATENCY_BUCKETS_MS = [round(10 ** (i / 10), 3) for i in range(53)]
+
+# Completed-ID checkpoints, used to resume a failed run without re-posting IDs
+CHECKPOINT_ENABLED = os.getenv('CHECKPOINT_ENABLED', 'true').lower() == 'true'
+CHECKPOINT_PATH = os.getenv('CHECKPOINT_PATH')  # None derives a path from the input file name
+CHECKPOINT_INTERVAL = int(os.getenv('CHECKPOINT_INTERVAL', '1000'))  # successful IDs per checkpoint object
+
+RequestResult = namedtuple(
+    'RequestResult',
+    ['id', 'status', 'http_code', 'latency_ms', 'start_time', 'end_time', 'error_class']
+)
+
+INPUT_SCHEMA = StructType([
+    StructField('id', LongType(), True),
+])
+
+RESULT_SCHEMA = StructType([
+    StructField('id', StringType(), False),
+    StructField('status', StringType(), False),
+    StructField('http_code', IntegerType(), True),
+    StructField('latency_ms', DoubleType(), False),
+    StructField('start_time', TimestampType(), False),
+    StructField('end_time', TimestampType(), False),
+    StructField('error_class', StringType(), True),
+])
+
 class BatchLogger:
-    def __init__(self, bucket, batch_id):
+    """Collects the per-request log for one partition and writes it to S3.
+
+    In streaming mode entries are spilled to a local temporary file instead of
+    being kept in memory, and every time the file reaches part_size it is
+    uploaded as one part of an S3 multipart upload, so memory stays flat
+    regardless of partition size.
+
+    With local_dir set (offline benchmarks) the log is written to a local file
+    instead and S3 is never contacted.
+    """
+    def __init__(self, bucket, batch_id, streaming=None, part_size=None, s3=None, local_dir=None):
         self.bucket = bucket
         self.batch_id = batch_id
         self.log_key = f"logs/processor_logs/batch_{batch_id}.log"
-        self.s3 = boto3.client('s3')
+        self.local_dir = local_dir or LOG_LOCAL_DIR
+        self.s3 = None if self.local_dir else (s3 or boto3.client('s3'))
         self.log_content = []
+        self._lock = threading.Lock()  # log_request is called from the request threads
+        
+        self.streaming = (LOG_STREAMING if streaming is None else streaming) and not self.local_dir
+        self.part_size = max(part_size or LOG_PART_SIZE, S3_MIN_PART_SIZE)
+        self._spill = None
+        self._spill_size = 0
+        self._upload_id = None
+        self._parts = []
+        self._next_part = 1
+        self._upload_lock = threading.Lock()  # serialises part uploads, not appends
+        self._finished = False
+        if self.streaming:
+            self._spill = self._new_spill()
         
     def write_header(self, input_path, batch_size):
         header = f"""=== Batch Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ===
@@ -33,13 +135,26 @@ Input File: {input_path}
 Found {batch_size} IDs to process
 
 """
-        self.log_content.append(header)
+        self._append(header)
         
     def write_footer(self):
+        """Append the footer and write the log out; later calls do nothing.
+
+        process_batch calls it again from its error path, which must not
+        fail (or hide the first error) when the first write-out raised.
+        """
+        if self._finished:
+            return
         footer = f"""
 === Batch Completed: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ==="""
-        self.log_content.append(footer)
-        self._write_to_s3()
+        self._append(footer)
+        self._finished = True
+        if self.local_dir:
+            self._write_to_local_file()
+        elif self.streaming:
+            self._complete_upload()
+        else:
+            self._write_to_s3()
         
     def log_request(self, risk_profile_id, request_url, payload, response, success, start_time, end_time):
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -52,11 +167,11 @@ Payload: {json.dumps(payload)}
 Request Start Time: {start_time.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}
 Request End Time: {end_time.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}
 Response Time: {response_time_ms:.2f} ms
-Response: {json.dumps(response, indent=2) if success else response}
+Response: {json.dumps(response) if success else response}
 Status: {'SUCCESS' if success else 'FAILED'}
 {'-' * 80}
 """
-        self.log_content.append(log_entry)
+        self._append(log_entry)
         
     def log_error(self, risk_profile_id, error):
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -66,107 +181,640 @@ Error: {str(error)}
 Traceback: {traceback.format_exc()}
 {'-' * 80}
 """
-        self.log_content.append(log_entry)
+        self._append(log_entry)
         
-    def _write_to_s3(self, retries=3, delay=1):
-        content = ''.join(self.log_content)
-        for attempt in range(retries):
-            try:
-                self.s3.put_object(
-        self.log_content.append(log_entry)
+    def _append(self, text):
+        full = None
+        with self._lock:
+            if self._finished:
+                logger.warning(f"Batch {self.batch_id} log already written; dropping entry")
+                return
+            if not self.streaming:
+                self.log_content.append(text)
+                return
+            data = text.encode('utf-8')
+            self._spill.write(data)
+            self._spill_size += len(data)
+            if self._spill_size >= self.part_size:
+                full = self._swap_spill()
+        if full is not None:
+            # Upload outside _lock so the request threads keep appending
+            self._upload_part(*full)
         
-    def _write_to_s3(self, retries=3, delay=1):
-        content = ''.join(self.log_content)
-        for attempt in range(retries):
+    def _new_spill(self):
+        return tempfile.TemporaryFile(dir=LOG_SPILL_DIR, prefix=f"batch_{self.batch_id}_")
+        
+    def _swap_spill(self):
+        """Hand the current spill file over for upload and start a new one (caller holds _lock).
+
+        Returns (part number, spill file); part numbers follow append order
+        even if the uploads finish out of order.
+        """
+        full = (self._next_part, self._spill)
+        self._next_part += 1
+        self._spill = self._new_spill()
+        self._spill_size = 0
+        return full
+        
+    @staticmethod
+    def _drain_spill(spill):
+        """Return the bytes of a spill file and close it"""
+        try:
+            spill.seek(0)
+            return spill.read()
+        finally:
+            spill.close()
+        
+    def _ensure_upload(self):
+        """Start the multipart upload on first use (caller holds _upload_lock)"""
+        if self._upload_id is None:
+            response = self._with_retries(
+                self.s3.create_multipart_upload, Bucket=self.bucket, Key=self.log_key
+            )
+            self._upload_id = response['UploadId']
+        
+    def _upload_part(self, part_number, spill):
+        body = self._drain_spill(spill)
+        with self._upload_lock:
+            self._ensure_upload()
+            response = self._with_retries(
+                self.s3.upload_part,
+                Bucket=self.bucket,
+                Key=self.log_key,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+                Body=body
+            )
+            self._parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        
+    def _complete_upload(self):
+        with self._lock:
+            part_number, spill = self._swap_spill() if self._spill_size > 0 else (None, None)
+            self._spill.close()
+            self._spill = None
+        with self._upload_lock:
             try:
-                self.s3.put_object(
+                if self._upload_id is None and part_number in (None, 1):
+                    # Everything fit in one part; a plain put is cheaper
+                    body = self._drain_spill(spill) if spill is not None else b''
+                    self._with_retries(self.s3.put_object, Bucket=self.bucket, Key=self.log_key, Body=body)
+                    return
+                self._ensure_upload()
+                if spill is not None:
+                    response = self._with_retries(
+                        self.s3.upload_part,
+                        Bucket=self.bucket,
+                        Key=self.log_key,
+                        UploadId=self._upload_id,
+                        PartNumber=part_number,
+                        Body=self._drain_spill(spill)
+                    )
+                    self._parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+                self._with_retries(
+                    self.s3.complete_multipart_upload,
                     Bucket=self.bucket,
                     Key=self.log_key,
-                    Body=content.encode('utf-8')
+                    UploadId=self._upload_id,
+                    MultipartUpload={'Parts': sorted(self._parts, key=lambda part: part['PartNumber'])}
                 )
-                return
+            except Exception:
+                if self._upload_id is not None:
+                    self.s3.abort_multipart_upload(
+                        Bucket=self.bucket, Key=self.log_key, UploadId=self._upload_id
+                    )
+                raise
+            finally:
+                if spill is not None and not spill.closed:
+                    spill.close()
+        
+    def _with_retries(self, operation, retries=3, delay=1, **kwargs):
+        for attempt in range(retries):
+            try:
+                return operation(**kwargs)
             except Exception as e:
                 if attempt == retries - 1:  # Last attempt
                     logger.error(f"Failed to write to S3 after {retries} attempts: {str(e)}")
                     raise
                 time.sleep(delay)
+        
+    def _write_to_local_file(self):
+        os.makedirs(self.local_dir, exist_ok=True)
+        with open(os.path.join(self.local_dir, f"batch_{self.batch_id}.log"), 'w') as f:
+            f.write(''.join(self.log_content))
+        
+    def _write_to_s3(self, retries=3, delay=1):
+        content = ''.join(self.log_content)
+        self._with_retries(
+            self.s3.put_object,
+            retries=retries,
+            delay=delay,
+            Bucket=self.bucket,
+            Key=self.log_key,
+            Body=content.encode('utf-8')
+        )
+
+def split_s3_path(path):
+    """Split s3://bucket/key (or s3a://, s3n://) into (bucket, key)"""
+    scheme, sep, rest = path.partition('://')
+    if not sep or scheme not in ('s3', 's3a', 's3n'):
+        raise ValueError(f"Not an S3 path: {path}")
+    bucket, _, key = rest.partition('/')
+    return bucket, key
+
+def default_checkpoint_path(input_path):
+    """Checkpoints live under checkpoints/<input file name>/ in the input bucket.
+
+    Returns None for input that is not on S3; local runs only checkpoint
+    when CHECKPOINT_PATH is set.
+    """
+    if not input_path.startswith(('s3://', 's3a://', 's3n://')):
+        return None
+    bucket, key = split_s3_path(input_path)
+    name = key.rstrip('/').rsplit('/', 1)[-1].split('.', 1)[0]
+    return f"s3://{bucket}/checkpoints/{name}/"
+
+class CheckpointWriter:
+    """Persists successfully processed IDs for one partition.
+
+    IDs are buffered and written every `interval` successes as a small
+    JSON-lines object, so progress survives an executor or step failure.
+    """
+    def __init__(self, checkpoint_path, partition_id, interval=None, s3=None):
+        self.bucket, prefix = split_s3_path(checkpoint_path)
+        self.prefix = prefix if prefix.endswith('/') else prefix + '/'
+        self.partition_id = partition_id
+        self.interval = interval or CHECKPOINT_INTERVAL
+        self.s3 = s3 or boto3.client('s3')
+        self.token = uuid.uuid4().hex[:8]  # keeps task retries from overwriting each other
+        self.sequence = 0
+        self.pending = []
+        
+    def add(self, risk_profile_id):
+        self.pending.append(risk_profile_id)
+        if len(self.pending) >= self.interval:
+            self.flush()
+        
+    def flush(self):
+        if not self.pending:
+            return
+        key = f"{self.prefix}part-{self.partition_id:05d}-{self.token}-{self.sequence:05d}.jsonl"
+        body = '\n'.join(json.dumps({'id': risk_profile_id}) for risk_profile_id in self.pending)
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=body.encode('utf-8'))
+        self.sequence += 1
+        self.pending = []
+
+COMPRESSION_SUFFIXES = ('.gz', '.zst', '.bz2', '.deflate', '.snappy', '.lz4')
+
+def list_input_files(input_path, limit=20):
+    """List up to `limit` data file names under an S3 or local input path"""
+    ignored = ('_', '.')  # _SUCCESS markers, hidden and CRC files
+    if input_path.startswith(('s3://', 's3a://', 's3n://')):
+        bucket, prefix = split_s3_path(input_path)
+        listing = boto3.client('s3').list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1000)
+        names = [obj['Key'] for obj in listing.get('Contents', []) if not obj['Key'].endswith('/')]
+    elif os.path.isdir(input_path):
+        names = sorted(os.path.join(input_path, name) for name in os.listdir(input_path))
+    else:
+        names = [input_path]
+    names = [name for name in names if not os.path.basename(name).startswith(ignored)]
+    return names[:limit]
+
+def sniff_json_array(input_path, name):
+    """True if an uncompressed .json file holds a JSON array rather than JSON lines"""
+    if input_path.startswith(('s3://', 's3a://', 's3n://')):
+        bucket, _ = split_s3_path(input_path)
+        head = boto3.client('s3').get_object(Bucket=bucket, Key=name, Range='bytes=0-1023')['Body'].read()
+    else:
+        with open(name, 'rb') as f:
+            head = f.read(1024)
+    return head.lstrip().startswith(b'[')
+
+def detect_input_format(input_path):
+    """Detect whether the input is Parquet, JSON lines or a (multiline) JSON array.
+
+    Returns 'parquet', 'jsonl' or 'json'. Compressed JSON is always treated as
+    JSON lines, which is what producer.py writes.
+    """
+    names = list_input_files(input_path)
+    if not names:
+        raise ValueError(f"No input files found at {input_path}")
+    name = names[0]
+    base = name
+    for suffix in COMPRESSION_SUFFIXES:
+        if base.endswith(suffix):
+            base = base[:-len(suffix)]
+            break
+    if base.endswith('.parquet'):
+        return 'parquet'
+    if base.endswith(('.jsonl', '.ndjson')) or base != name:
+        return 'jsonl'
+    return 'json' if sniff_json_array(input_path, name) else 'jsonl'
+
+def load_completed_ids(spark, checkpoint_path, id_schema):
+    """Return a DataFrame of already completed IDs, or None if there is no checkpoint yet"""
+    bucket, prefix = split_s3_path(checkpoint_path)
+    listing = boto3.client('s3').list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1)
+    if listing.get('KeyCount', 0) == 0:
+        return None
+    return spark.read.schema(id_schema).json(checkpoint_path)
 
-def post_risk_profile(risk_profile_id, batch_logger):
-    """Post a risk profile ID to the API Gateway endpoint"""
+class HistogramParam(AccumulatorParam):
+    """Accumulates fixed-bucket histograms represented as lists of counts"""
+    def zero(self, value):
+        return [0] * len(value)
+        
+    def addInPlace(self, value1, value2):
+        for i, count in enumerate(value2):
+            value1[i] += count
+        return value1
+
+def latency_bucket(latency_ms):
+    """Index of the LATENCY_BUCKETS_MS bucket a latency falls in"""
+    return bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)
+
+def histogram_percentile(counts, percentile):
+    """Upper bound in ms of the bucket holding the given percentile (0-100)"""
+    total = sum(counts)
+    if total == 0:
+        return 0.0
+    rank = total * percentile / 100
+    cumulative = 0
+    for i, count in enumerate(counts):
+        cumulative += count
+        if cumulative >= rank:
+            return LATENCY_BUCKETS_MS[min(i, len(LATENCY_BUCKETS_MS) - 1)]
+    return LATENCY_BUCKETS_MS[-1]
+
+class ProcessorStats:
+    """Cluster-wide batch statistics backed by Spark accumulators.
+
+    Partitions add their totals once when they finish; the driver reads the
+    values for progress lines and the final summary.
+    """
+    def __init__(self, spark_context):
+        self.successful = spark_context.accumulator(0)
+        self.failed = spark_context.accumulator(0)
+        self.total_latency_ms = spark_context.accumulator(0.0)
+        self.latency_counts = spark_context.accumulator(
+            [0] * (len(LATENCY_BUCKETS_MS) + 1), HistogramParam()
+        )
+        
+    def add_partition(self, successful, failed, total_latency_ms, latency_counts):
+        self.successful.add(successful)
+        self.failed.add(failed)
+        self.total_latency_ms.add(total_latency_ms)
+        self.latency_counts.add(latency_counts)
+        
+    def summary(self, start_time, end_time=None):
+        end_time = end_time or datetime.now()
+        duration = (end_time - start_time).total_seconds()
+        successful = self.successful.value
+        failed = self.failed.value
+        processed = successful + failed
+        counts = list(self.latency_counts.value)
+        return {
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat(),
+            'duration_seconds': round(duration, 3),
+            'processed': processed,
+            'successful': successful,
+            'failed': failed,
+            'throughput_per_second': round(processed / duration, 3) if duration > 0 else 0.0,
+            'latency_ms': {
+                'mean': round(self.total_latency_ms.value / processed, 3) if processed else 0.0,
+                'p50': histogram_percentile(counts, 50),
+                'p95': histogram_percentile(counts, 95),
+                'p99': histogram_percentile(counts, 99),
+            },
+            'latency_histogram': {
+                'bucket_upper_bounds_ms': LATENCY_BUCKETS_MS,
+                'counts': counts,
+            },
+        }
+
+class ProgressReporter(threading.Thread):
+    """Logs cluster-wide progress from the accumulators at a fixed interval.
+
+    Accumulator updates reach the driver when partitions finish, so progress
+    advances one partition at a time.
+    """
+    def __init__(self, stats, start_time, interval):
+        super().__init__(daemon=True)
+        self.stats = stats
+        self.start_time = start_time
+        self.interval = interval
+        self._stopped = threading.Event()
+        
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            summary = self.stats.summary(self.start_time)
+            latency = summary['latency_ms']
+            logger.info(
+                f"Progress: {summary['processed']} IDs processed ({summary['failed']} failed), "
+                f"{summary['throughput_per_second']:.1f} IDs/s, "
+                f"p50 {latency['p50']:.0f} ms, p95 {latency['p95']:.0f} ms, p99 {latency['p99']:.0f} ms"
+            )
+        
+    def stop(self):
+        self._stopped.set()
+
+def write_json(path, data):
+    """Write a JSON document to an S3 path or a local file"""
+    body = json.dumps(data, indent=2)
+    if path.startswith(('s3://', 's3a://', 's3n://')):
+        bucket, key = split_s3_path(path)
+        boto3.client('s3').put_object(Bucket=bucket, Key=key, Body=body.encode('utf-8'))
+    else:
+        with open(path, 'w') as f:
+            f.write(body)
+
+def load_settings(spark=None):
+    """Resolve PROCESSOR_SETTINGS from the environment and, on the driver, the Spark conf"""
+    settings = {}
+    for name, (cast, default) in PROCESSOR_SETTINGS.items():
+        value = os.getenv(name.upper())
+        if spark is not None:
+            value = spark.conf.get(f"spark.riskprofile.{name}", value)
+        settings[name] = cast(value) if value is not None else default
+    return settings
+
+class TokenBucket:
+    """Blocking token bucket; a rate of 0 or less disables it"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+        
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+class AIMDLimiter:
+    """Caps requests in flight, growing the cap by one per window of successes
+    and halving it whenever the endpoint signals congestion (429/5xx/timeouts).
+    """
+    def __init__(self, initial, minimum, maximum, decrease_factor=0.5):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        
+    def release(self, congested):
+        with self._condition:
+            self.in_flight -= 1
+            if congested:
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+class CircuitBreaker:
+    """Pauses all requests of a partition for `cooldown` seconds when the error
+    ratio over the last `window` outcomes reaches `error_rate`.
+    """
+    def __init__(self, error_rate, window, min_requests, cooldown):
+        self.error_rate = error_rate
+        self.min_requests = min(min_requests, window)
+        self.cooldown = cooldown
+        self.outcomes = deque(maxlen=window)
+        self.open_until = 0
+        self._lock = threading.Lock()
+        
+    def wait_until_closed(self):
+        while True:
+            with self._lock:
+                remaining = self.open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+        
+    def record(self, failed):
+        with self._lock:
+            self.outcomes.append(failed)
+            if len(self.outcomes) < self.min_requests:
+                return
+            error_rate = sum(self.outcomes) / len(self.outcomes)
+            if error_rate >= self.error_rate and self.open_until <= time.monotonic():
+                logger.warning(f"Circuit opened at {error_rate:.0%} errors, pausing partition for {self.cooldown:.1f} seconds")
+                self.open_until = time.monotonic() + self.cooldown
+                self.outcomes.clear()
+
+class RequestThrottle:
+    """Applies the rate limiter, AIMD limiter, circuit breaker and jittered
+    retries around a single HTTP request.
+    """
+    def __init__(self, settings):
+        self.bucket = TokenBucket(settings['rate_limit'], settings['rate_burst'])
+        self.limiter = AIMDLimiter(
+            settings['initial_in_flight'] or settings['max_in_flight'],
+            settings['min_in_flight'], settings['max_in_flight']
+        )
+        self.breaker = CircuitBreaker(
+            settings['breaker_error_rate'], settings['breaker_window'],
+            settings['breaker_min_requests'], settings['breaker_cooldown']
+        )
+        self.max_retries = settings['max_retries']
+        self.backoff_base = settings['backoff_base']
+        self.backoff_cap = settings['backoff_cap']
+        
+    def backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, never shorter than a Retry-After hint"""
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_cap))
+        return delay
+        
+    def send(self, request):
+        """Call request() until it returns a non-retryable response or retries run out"""
+        attempt = 0
+        while True:
+            self.breaker.wait_until_closed()
+            self.bucket.acquire()
+            self.limiter.acquire()
+            retry_after = None
+            try:
+                response = request()
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(True)
+                if attempt >= self.max_retries:
+                    raise
+            except Exception:
+                self._record(False)
+                raise
+            else:
+                congested = response.status_code == 429 or response.status_code >= 500
+                self._record(congested)
+                if not congested or attempt >= self.max_retries:
+                    return response
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            time.sleep(self.backoff(attempt, retry_after))
+            attempt += 1
+        
+    def _record(self, congested):
+        self.limiter.release(congested)
+        self.breaker.record(congested)
+
+def parse_retry_after(value):
+    """Return a Retry-After header given in seconds, ignoring HTTP-date values"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def create_http_session(pool_size):
+    """Create a keep-alive session whose connection pool matches the in-flight limit"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def run_bounded(executor, fn, items, max_in_flight):
+    """Submit fn(item) for each item, keeping at most max_in_flight calls pending.
+
+    Yields (item, future) pairs in completion order.
+    """
+    pending = {}
+    for item in items:
+        if len(pending) >= max_in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+        pending[executor.submit(fn, item)] = item
+    for future in as_completed(list(pending)):
+        yield pending.pop(future), future
+
+def request_result(risk_profile_id, status, http_code, start_time, end_time, error_class=None):
+    """Build the structured result row for one request"""
+    latency_ms = (end_time - start_time).total_seconds() * 1000
+    return RequestResult(str(risk_profile_id), status, http_code, latency_ms, start_time, end_time, error_class)
+
+def post_risk_profile(risk_profile_id, batch_logger, session=None, throttle=None):
+    """Post a risk profile ID to the API Gateway endpoint.
+
+    Returns a RequestResult whose status is SUCCESS, FAILED (non-200 response)
+    or ERROR (exception raised before a response was received).
+    """
     api_url = os.getenv(
         'API_GATEWAY_URL', 
         'https://o33gysuh1e.execute-api.us-east-1.amazonaws.com/prod/risk-profile'
     )
     payload = {"risk_profile_id": risk_profile_id}
+    start_time = datetime.now()
     
     try:
         logger.info(f"Processing ID: {risk_profile_id}")
-        start_time = datetime.now()
-        response = requests.post(api_url, json=payload)
+        send = partial(
+            (session or requests).post, api_url, json=payload, timeout=(CONNECT_TIMEOUT, REQUEST_TIMEOUT)
+        )
+        response = throttle.send(send) if throttle else send()
         end_time = datetime.now()
         
         if response.status_code == 200:
             response_data = response.json()
             logger.info(f"Success - Risk Profile ID: {risk_profile_id}")
             batch_logger.log_request(risk_profile_id, api_url, payload, response_data, True, start_time, end_time)
-            return True
+            return request_result(risk_profile_id, 'SUCCESS', response.status_code, start_time, end_time)
         else:
             logger.error(f"Failed - Risk Profile ID: {risk_profile_id}")
             batch_logger.log_request(risk_profile_id, api_url, payload, 
                                   f"Status Code: {response.status_code}, Response: {response.text}", 
                                   False, start_time, end_time)
-            return False
+            return request_result(risk_profile_id, 'FAILED', response.status_code, start_time, end_time)
             
     except Exception as e:
         logger.error(f"Error - Risk Profile ID: {risk_profile_id}")
         logger.error(traceback.format_exc())
         batch_logger.log_error(risk_profile_id, e)
-        return False
+        return request_result(risk_profile_id, 'ERROR', None, start_time, datetime.now(), type(e).__name__)
+
+def process_batch(ids, settings=None, stats=None, input_path=None, checkpoint_path=None):
+    """Process a batch of IDs, yielding one RequestResult per ID.
 
-def process_batch(ids):
-    """Process a batch of IDs"""
+    stats is an optional ProcessorStats the partition totals are added to;
+    input_path is only used for the log header, and completed IDs are
+    recorded under checkpoint_path when it is set.
+    """
+    settings = settings or load_settings()
+    max_in_flight = settings['max_in_flight']
+    task_context = TaskContext.get()
+    partition_id = task_context.partitionId() if task_context else 0
     batch_start_time = datetime.now()
     timestamp = batch_start_time.strftime("%Y%m%d_%H%M%S")
-    batch_logger = BatchLogger("ssn0212", timestamp)
+    # Partitions starting in the same second must not overwrite each other's log
+    batch_logger = BatchLogger("ssn0212", f"{timestamp}_p{partition_id:05d}")
+    successful_requests = 0
+    failed_requests = 0
+    total_response_time = 0
+    latency_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    session = create_http_session(max_in_flight)
+    throttle = RequestThrottle(settings)
+    checkpoint = None
+    if checkpoint_path:
+        checkpoint = CheckpointWriter(checkpoint_path, partition_id)
+    
+    def post(risk_profile_id):
+        return post_risk_profile(risk_profile_id, batch_logger, session, throttle)
     
     try:
         # Convert iterator to list and extract IDs
         id_list = [row['id'] for row in ids]
         batch_size = len(id_list)
-        logger.info(f"Processing batch of {batch_size} IDs")
+        logger.info(f"Processing batch of {batch_size} IDs with up to {max_in_flight} requests in flight")
         batch_logger.write_header(input_path, batch_size)
         
-        # Process IDs in chunks for better logging
+        # Report progress in chunks for better logging
         chunk_size = 100
-        successful_requests = 0
-        failed_requests = 0
-        total_response_time = 0
+        completed = 0
+        chunk_start_time = datetime.now()
         
-        for i in range(0, len(id_list), chunk_size):
-            chunk = id_list[i:i + chunk_size]
-            chunk_start_time = datetime.now()
-            
-            # Process chunk
-            for risk_profile_id in chunk:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for risk_profile_id, future in run_bounded(executor, post, id_list, max_in_flight):
                 try:
-                    request_start = datetime.now()
-                    success = post_risk_profile(risk_profile_id, batch_logger)
-                    request_time = (datetime.now() - request_start).total_seconds() * 1000  # ms
-                    total_response_time += request_time
-                    
-                    if success:
-                        successful_requests += 1
-                    else:
-                        failed_requests += 1
-                        
+                    result = future.result()
                 except Exception as e:
-                    failed_requests += 1
                     logger.error(f"Error processing ID {risk_profile_id}: {str(e)}")
                     logger.error(traceback.format_exc())
                     batch_logger.log_error(risk_profile_id, e)
-            
-            chunk_time = (datetime.now() - chunk_start_time).total_seconds()
-            logger.info(f"Processed chunk {i//chunk_size + 1} ({len(chunk)} IDs) in {chunk_time:.2f} seconds")
+                    now = datetime.now()
+                    result = request_result(risk_profile_id, 'ERROR', None, now, now, type(e).__name__)
+                
+                total_response_time += result.latency_ms
+                latency_counts[latency_bucket(result.latency_ms)] += 1
+                if result.status == 'SUCCESS':
+                    successful_requests += 1
+                    if checkpoint:
+                        checkpoint.add(risk_profile_id)
+                else:
+                    failed_requests += 1
+                yield result
+                
+                completed += 1
+                if completed % chunk_size == 0 or completed == batch_size:
+                    chunk_time = (datetime.now() - chunk_start_time).total_seconds()
+                    chunk_len = completed % chunk_size or chunk_size
+                    logger.info(f"Processed chunk {(completed - 1) // chunk_size + 1} ({chunk_len} IDs) in {chunk_time:.2f} seconds")
+                    chunk_start_time = datetime.now()
         
         # Log batch statistics
         batch_time = (datetime.now() - batch_start_time).total_seconds()
@@ -185,8 +833,15 @@ def process_batch(ids):
         logger.error(traceback.format_exc())
         batch_logger.log_error("BATCH", e)
         batch_logger.write_footer()  # Ensure we write the log even on error
-    
-    return [(successful_requests, failed_requests)]
+    finally:
+        session.close()
+        if stats is not None:
+            stats.add_partition(successful_requests, failed_requests, total_response_time, latency_counts)
+        if checkpoint:
+            try:
+                checkpoint.flush()
+            except Exception as e:
+                logger.error(f"Failed to write checkpoint: {str(e)}")
 
 def main():
     try:
@@ -203,38 +858,101 @@ def main():
         
         logger.info(f"Successfully created Spark session. Version: {spark.version}")
         
-        # Get input path from arguments
+        # Get input paths from arguments; run_cluster.py passes a shard of files per step
         if len(sys.argv) < 2:
             raise ValueError("Input path argument is required")
         
-        global input_path
-        input_path = sys.argv[1]
+        input_paths = sys.argv[1:]
+        input_path = ','.join(input_paths)
         logger.info(f"Input path: {input_path}")
         
+        checkpoint_path = None
+        if CHECKPOINT_ENABLED:
+            checkpoint_path = CHECKPOINT_PATH or default_checkpoint_path(input_paths[0])
+            if checkpoint_path:
+                logger.info(f"Checkpoint path: {checkpoint_path}")
+            else:
+                logger.info("Input is not on S3 and CHECKPOINT_PATH is not set; checkpointing disabled")
+        
+        settings = load_settings(spark)
+        logger.info(f"Processor settings: {json.dumps(settings)}")
+        
         try:
             # Read input data
-            logger.info(f"Reading data from: {input_path}")
-            df = spark.read.option("multiline", "true").json(input_path)
+            input_format = detect_input_format(input_paths[0])
+            logger.info(f"Reading {input_format} data from: {input_path}")
+            reader = spark.read
+            if settings['fast_path']:
+                # An explicit schema avoids a full inference pass over the input
+                reader = reader.schema(INPUT_SCHEMA)
+            if input_format == 'parquet':
+                df = reader.parquet(*input_paths)
+            else:
+                # Only a JSON array needs multiline mode, which reads each file as one split
+                df = reader.option("multiline", str(input_format == 'json').lower()).json(input_paths)
             
-            logger.info("DataFrame Schema:")
-            df.printSchema()
+            # Skip IDs already completed by a previous run of the same input
+            if checkpoint_path:
+                completed_ids = load_completed_ids(spark, checkpoint_path, df.select("id").schema)
+                if completed_ids is not None:
+                    logger.info("Found existing checkpoint, processing only IDs not yet completed")
+                    df = df.join(completed_ids, on="id", how="left_anti")
             
-            logger.info("Sample Data:")
-            df.show(5, truncate=False)
+            if settings['fast_path']:
+                logger.info("Fast path: skipping schema, sample and count diagnostics")
+            else:
+                logger.info("DataFrame Schema:")
+                df.printSchema()
+                
+                logger.info("Sample Data:")
+                df.show(5, truncate=False)
+                
+                total_ids = df.count()
+                logger.info(f"Successfully read {total_ids} records")
             
-            total_ids = df.count()
-            logger.info(f"Successfully read {total_ids} records")
+            # A multiline JSON file is read as a single split; spread it over the cluster
+            if settings['target_partitions'] > 0:
+                logger.info(f"Repartitioning input to {settings['target_partitions']} partitions")
+                df = df.repartition(settings['target_partitions'])
+            
+            # Process IDs in batches, writing one structured row per ID
+            results_path = RESULTS_PATH or \
+                f"s3://ssn0212/logs/processor_results/run_{start_time.strftime('%Y%m%d_%H%M%S')}/"
+            logger.info(f"Starting batch processing, writing {RESULTS_FORMAT} results to {results_path}")
+            stats = ProcessorStats(spark.sparkContext)
+            progress = None
+            if settings['progress_interval'] > 0:
+                progress = ProgressReporter(stats, start_time, settings['progress_interval'])
+                progress.start()
+            try:
+                results = spark.createDataFrame(
+                    df.rdd.mapPartitions(partial(
+                        process_batch, settings=settings, stats=stats,
+                        input_path=input_path, checkpoint_path=checkpoint_path
+                    )),
+                    RESULT_SCHEMA
+                )
+                results.write.mode("overwrite").format(RESULTS_FORMAT).save(results_path)
+            finally:
+                if progress:
+                    progress.stop()
             
-            # Process IDs in batches
-            logger.info("Starting batch processing...")
-            df.rdd.mapPartitions(process_batch).collect()
+            # Cluster-wide summary from the accumulators
+            summary = stats.summary(start_time)
+            summary.update({'input_path': input_path, 'results_path': results_path})
+            summary_path = SUMMARY_PATH or \
+                f"s3://ssn0212/logs/processor_summaries/run_{start_time.strftime('%Y%m%d_%H%M%S')}.json"
+            logger.info(f"Processed {summary['processed']} records")
+            logger.info(f"Run summary: {json.dumps({k: v for k, v in summary.items() if k != 'latency_histogram'})}")
+            write_json(summary_path, summary)
+            logger.info(f"Wrote run summary to {summary_path}")
             
             # Log completion
             end_time = datetime.now()
             duration = end_time - start_time
             logger.info("Processing complete!")
             logger.info(f"Total duration: {duration}")
-            logger.info("Check S3 logs for detailed processing results")
+            logger.info(f"Check S3 logs for detailed processing results; per-ID results are in {results_path}")
             
         except Exception as e:
             logger.error(f"Error processing data: {str(e)}")
@@ -1,8 +1,12 @@
-import json
+import argparse
+import zlib
 import boto3
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import logging
 
+from s3_multipart import DEFAULT_PART_SIZE, MultipartUploader
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -10,57 +14,161 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def write_ids_to_s3(customer_ids, bucket_name="ssn0212"):
-    """Write customer IDs to S3"""
-    s3 = boto3.client('s3')
-    
-    # Create a timestamp for the filename
+# File extension per output format and compression
+FORMAT_EXTENSIONS = {'json': '.json', 'jsonl': '.jsonl', 'parquet': '.parquet'}
+COMPRESSION_EXTENSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# IDs serialized per chunk; bounds the size of each in-memory string
+CHUNK_SIZE = 100000
+
+def create_s3_client(endpoint_url=None):
+    """S3 client, optionally pointed at a local S3 stand-in such as moto or MinIO"""
+    return boto3.client('s3', endpoint_url=endpoint_url)
+
+def create_compressor(compression):
+    """Streaming compressor with compress()/flush(), or None for no compression"""
+    if compression == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor().compressobj()
+    return None
+
+def iter_json_chunks(start, stop, output_format):
+    """Serialize IDs [start, stop) as JSON Lines, or as the body of a JSON array"""
+    first = True
+    for chunk_start in range(start, stop, CHUNK_SIZE):
+        chunk_stop = min(chunk_start + CHUNK_SIZE, stop)
+        if output_format == 'jsonl':
+            yield ''.join(f'{{"id": {i}}}\n' for i in range(chunk_start, chunk_stop)).encode('utf-8')
+        else:
+            body = ',\n'.join(f'  {{"id": {i}}}' for i in range(chunk_start, chunk_stop))
+            yield (('[\n' if first else ',\n') + body).encode('utf-8')
+        first = False
+    if output_format == 'json':
+        yield (']\n' if not first else '[]\n').encode('utf-8')
+
+def write_parquet_shard(uploader, start, stop, compression):
+    try:
+        import pyarrow
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("parquet output requires the pyarrow package")
+    schema = pyarrow.schema([('id', pyarrow.int64())])
+    # Parquet compresses internally, so the codec goes into the file itself
+    codec = {'none': 'NONE', 'gzip': 'GZIP', 'zstd': 'ZSTD'}[compression]
+    with pq.ParquetWriter(uploader, schema, compression=codec) as writer:
+        for chunk_start in range(start, stop, CHUNK_SIZE):
+            ids = pyarrow.array(range(chunk_start, min(chunk_start + CHUNK_SIZE, stop)), type=pyarrow.int64())
+            writer.write_table(pyarrow.Table.from_arrays([ids], schema=schema))
+
+def write_shard(bucket_name, key, start, stop, output_format, compression,
+                part_size=DEFAULT_PART_SIZE, part_concurrency=4, endpoint_url=None):
+    """Stream IDs [start, stop) into one S3 object and return the bytes written.
+
+    Runs in a worker process, so it creates its own S3 client.
+    """
+    s3 = create_s3_client(endpoint_url)
+    with MultipartUploader(s3, bucket_name, key, part_size, part_concurrency) as uploader:
+        if output_format == 'parquet':
+            write_parquet_shard(uploader, start, stop, compression)
+        else:
+            compressor = create_compressor(compression)
+            for chunk in iter_json_chunks(start, stop, output_format):
+                uploader.write(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                uploader.write(compressor.flush())
+    return uploader.bytes_written
+
+def write_ids_to_s3(count, bucket_name="ssn0212", output_format="json", compression="none",
+                    shards=1, workers=4, part_size=DEFAULT_PART_SIZE, part_concurrency=4,
+                    endpoint_url=None):
+    """Stream `count` generated IDs to S3 and return (path, bytes written).
+
+    The legacy json format is written as a single JSON array file. jsonl and
+    parquet are written as `shards` part files under one prefix, serialized by
+    `workers` processes; each shard is streamed through a multipart upload with
+    `part_concurrency` parts in flight, so memory stays flat for any count.
+    """
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"customer_ids_{timestamp}.json"
-    s3_path = f"input/{filename}"
-    
-    # Convert customer IDs to JSON string
-    data = json.dumps(customer_ids, indent=2)
-    
+    if output_format == 'json':
+        if compression != 'none':
+            raise ValueError("The json format does not support compression; use jsonl")
+        shards = 1
+        keys = [f"input/customer_ids_{timestamp}.json"]
+        full_path = f"s3://{bucket_name}/{keys[0]}"
+    else:
+        prefix = f"input/customer_ids_{timestamp}/"
+        extension = FORMAT_EXTENSIONS[output_format]
+        if output_format != 'parquet':
+            extension += COMPRESSION_EXTENSIONS[compression]
+        shards = max(1, min(shards, count))
+        keys = [f"{prefix}part-{index:05d}{extension}" for index in range(shards)]
+        full_path = f"s3://{bucket_name}/{prefix}"
+    shard_size = -(-count // shards)  # ceiling division
+
     try:
-        # Upload to S3
-        s3.put_object(
-            Bucket=bucket_name,
-            Key=s3_path,
-            Body=data
-        )
-        full_path = f"s3://{bucket_name}/{s3_path}"
-        logger.info(f"Successfully wrote {len(customer_ids)} IDs to {full_path}")
-        return full_path
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, shards))) as executor:
+            futures = [
+                executor.submit(
+                    write_shard, bucket_name, key, index * shard_size, min((index + 1) * shard_size, count),
+                    output_format, compression, part_size, part_concurrency, endpoint_url
+                )
+                for index, key in enumerate(keys)
+            ]
+            bytes_written = sum(future.result() for future in futures)
+        logger.info(f"Successfully wrote {count} IDs in {shards} {output_format} file(s) to {full_path}")
+        return full_path, bytes_written
     except Exception as e:
         logger.error(f"Error writing to S3: {str(e)}")
         raise
 
-def generate_test_ids(count=100000):
-    """Generate test IDs"""
-    return [{"id": i} for i in range(count)]
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate test IDs and stream them to S3")
+    parser.add_argument('--count', type=int, default=100000, help='Number of IDs to generate')
+    parser.add_argument('--bucket', default='ssn0212', help='Destination S3 bucket')
+    parser.add_argument('--format', dest='output_format', default='json', choices=list(FORMAT_EXTENSIONS),
+                        help='json writes one JSON array file (legacy); jsonl and parquet write shards')
+    parser.add_argument('--compression', default='none', choices=list(COMPRESSION_EXTENSIONS),
+                        help='Shard compression (jsonl and parquet only)')
+    parser.add_argument('--shards', type=int, default=8, help='Number of shards to write')
+    parser.add_argument('--workers', type=int, default=4, help='Processes serializing shards in parallel')
+    parser.add_argument('--part-size-mb', type=int, default=DEFAULT_PART_SIZE // (1024 * 1024),
+                        help='Multipart upload part size in MiB (minimum 5)')
+    parser.add_argument('--part-concurrency', type=int, default=4, help='Parts uploaded in parallel per shard')
+    parser.add_argument('--endpoint-url', help='S3 endpoint override, e.g. a local moto or MinIO server')
+    return parser.parse_args()
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
         start_time = datetime.now()
-        logger.info("Starting ID generation process...")
-        
-        # Generate test IDs
-        customer_ids = generate_test_ids()
-        generation_time = datetime.now() - start_time
-        logger.info(f"Generated {len(customer_ids)} test IDs in {generation_time.total_seconds():.2f} seconds")
-        
-        # Write to S3
-        write_start = datetime.now()
-        s3_path = write_ids_to_s3(customer_ids)
-        write_time = datetime.now() - write_start
-        total_time = datetime.now() - start_time
-        
+        logger.info(f"Streaming {args.count} test IDs to S3...")
+
+        s3_path, bytes_written = write_ids_to_s3(
+            args.count,
+            args.bucket,
+            args.output_format,
+            args.compression,
+            args.shards,
+            args.workers,
+            args.part_size_mb * 1024 * 1024,
+            args.part_concurrency,
+            args.endpoint_url
+        )
+        total_time = (datetime.now() - start_time).total_seconds()
+
         logger.info("Process completed successfully")
         logger.info(f"File location: {s3_path}")
-        logger.info(f"Write time: {write_time.total_seconds():.2f} seconds")
-        logger.info(f"Total time: {total_time.total_seconds():.2f} seconds")
-        
+        logger.info(f"Bytes written: {bytes_written}")
+        logger.info(f"Total time: {total_time:.2f} seconds")
+        if total_time > 0:
+            logger.info(f"Throughput: {bytes_written / total_time / (1024 * 1024):.2f} MiB/s, "
+                        f"{args.count / total_time:.0f} IDs/s")
+
     except Exception as e:
         logger.error(f"Process failed: {str(e)}")
         raise
@@ -1,8 +1,11 @@
+import argparse
 import boto3
+import copy
 import json
 import time
 import logging
-from datetime import datetime
+from botocore.exceptions import ClientError
+from datetime import datetime, timezone
 
 # Configure logging
 logging.basicConfig(
@@ -11,42 +14,486 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def run_emr_cluster():
+CLUSTER_TERMINAL_STATES = ['TERMINATED', 'TERMINATED_WITH_ERRORS']
+CLUSTER_TRANSITION_STATES = ['STARTING', 'BOOTSTRAPPING', 'TERMINATING']
+STEP_TERMINAL_STATES = ['COMPLETED', 'CANCELLED', 'FAILED', 'INTERRUPTED']
+
+# Poll quickly while something is changing and back off while it is not
+MIN_POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 60
+TRANSITION_POLL_INTERVAL = 15  # ceiling while the cluster is starting or terminating
+
+# Tag identifying long-running clusters that steps can be submitted to
+WARM_CLUSTER_TAG = {'Key': 'WarmCluster', 'Value': 'risk-profile-processor'}
+DEFAULT_IDLE_TIMEOUT = 3600  # seconds a warm cluster may sit idle before EMR terminates it
+
+MAX_STEP_CONCURRENCY = 256  # EMR limit on StepConcurrencyLevel
+LIST_STEPS_MAX_IDS = 10  # EMR limit on StepIds per ListSteps call
+
+def seconds_between(start, end):
+    if start is None or end is None:
+        return None
+    return round((end - start).total_seconds(), 1)
+
+def isoformat(value):
+    return value.isoformat() if value is not None else None
+
+class ClusterWaiter:
+    """Tracks an EMR cluster and its steps until they finish.
+
+    Polls describe_cluster and list_steps, logging every cluster and step
+    state change as it is observed along with step failure details. The
+    poll interval starts at MIN_POLL_INTERVAL, resets to it on any state
+    change, and doubles while nothing changes up to MAX_POLL_INTERVAL
+    (TRANSITION_POLL_INTERVAL while the cluster is starting or terminating).
+    The observed timeline is returned as a report that splits wall-clock
+    time into provisioning, bootstrapping and per-step processing.
+    """
+    def __init__(self, emr, cluster_id, step_ids=None, start_time=None):
+        self.emr = emr
+        self.cluster_id = cluster_id
+        self.step_ids = set(step_ids) if step_ids else None
+        self.start_time = start_time or datetime.now(timezone.utc)
+        self.cluster_state = None
+        self.cluster = None
+        self.cluster_transitions = []
+        self.steps = {}
+
+    def poll(self):
+        """Refresh cluster and step state; returns True if anything changed"""
+        now = datetime.now(timezone.utc)
+        changed = False
+        self.cluster = self.emr.describe_cluster(ClusterId=self.cluster_id)['Cluster']
+        state = self.cluster['Status']['State']
+        if state != self.cluster_state:
+            logger.info(f"Cluster {self.cluster_id}: {self.cluster_state or 'NEW'} -> {state}")
+            self.cluster_transitions.append({'state': state, 'observed_at': now})
+            self.cluster_state = state
+            changed = True
+
+        for step in self.list_steps():
+            step_id = step['Id']
+            step_state = step['Status']['State']
+            previous = self.steps.get(step_id)
+            if previous is None or previous['Status']['State'] != step_state:
+                logger.info(f"Step {step_id} ({step['Name']}): "
+                            f"{previous['Status']['State'] if previous else 'NEW'} -> {step_state}")
+                failure = step['Status'].get('FailureDetails')
+                if step_state == 'FAILED' and failure:
+                    logger.error(f"Step {step_id} failed: {failure.get('Reason')} - {failure.get('Message')} "
+                                 f"(log: {failure.get('LogFile')})")
+                changed = True
+            self.steps[step_id] = step
+        return changed
+
+    def list_steps(self):
+        """Tracked steps (all steps when none are tracked); ListSteps takes at most 10 StepIds per call"""
+        paginator = self.emr.get_paginator('list_steps')
+        step_ids = list(self.step_ids or [])
+        chunks = [step_ids[i:i + LIST_STEPS_MAX_IDS] for i in range(0, len(step_ids), LIST_STEPS_MAX_IDS)] or [None]
+        for chunk in chunks:
+            kwargs = {'ClusterId': self.cluster_id}
+            if chunk:
+                kwargs['StepIds'] = chunk
+            for page in paginator.paginate(**kwargs):
+                yield from page['Steps']
+
+    def steps_done(self):
+        if not self.step_ids:
+            return False
+        return all(
+            step_id in self.steps and self.steps[step_id]['Status']['State'] in STEP_TERMINAL_STATES
+            for step_id in self.step_ids
+        )
+
+    def wait(self, until_steps_done=False):
+        """Block until the cluster terminates, or with until_steps_done until
+        every tracked step has finished. Returns the timeline report.
+        """
+        interval = MIN_POLL_INTERVAL
+        while True:
+            changed = self.poll()
+            if self.cluster_state in CLUSTER_TERMINAL_STATES:
+                break
+            if until_steps_done and self.steps_done():
+                break
+            ceiling = TRANSITION_POLL_INTERVAL if self.cluster_state in CLUSTER_TRANSITION_STATES \
+                else MAX_POLL_INTERVAL
+            interval = MIN_POLL_INTERVAL if changed else min(interval * 2, ceiling)
+            time.sleep(interval)
+        return self.report()
+
+    def phase_duration(self, state):
+        """Observed seconds spent in a cluster state, to poll precision"""
+        for current, following in zip(self.cluster_transitions, self.cluster_transitions[1:]):
+            if current['state'] == state:
+                return seconds_between(current['observed_at'], following['observed_at'])
+        return None
+
+    def report(self):
+        end_time = datetime.now(timezone.utc)
+        timeline = self.cluster['Status'].get('Timeline', {})
+        status = self.cluster['Status']
+        steps = []
+        for step in sorted(self.steps.values(), key=lambda s: s['Status'].get('Timeline', {}).get('CreationDateTime') or end_time):
+            step_timeline = step['Status'].get('Timeline', {})
+            started = step_timeline.get('StartDateTime')
+            ended = step_timeline.get('EndDateTime')
+            failure = step['Status'].get('FailureDetails') or {}
+            steps.append({
+                'id': step['Id'],
+                'name': step['Name'],
+                'state': step['Status']['State'],
+                'created_at': isoformat(step_timeline.get('CreationDateTime')),
+                'started_at': isoformat(started),
+                'ended_at': isoformat(ended),
+                'duration_seconds': seconds_between(started, ended),
+                'failure_reason': failure.get('Reason'),
+                'failure_message': failure.get('Message'),
+                'failure_log': failure.get('LogFile'),
+            })
+        first_step_start = min((s['Status']['Timeline']['StartDateTime'] for s in self.steps.values()
+                                if s['Status'].get('Timeline', {}).get('StartDateTime')), default=None)
+        # Concurrent steps overlap, so processing is the span from the first
+        # step start to the last step end rather than the sum of durations
+        last_step_end = max((s['Status']['Timeline']['EndDateTime'] for s in self.steps.values()
+                             if s['Status'].get('Timeline', {}).get('EndDateTime')), default=None)
+        return {
+            'cluster_id': self.cluster_id,
+            'final_state': self.cluster_state,
+            'state_change_reason': status.get('StateChangeReason', {}),
+            'wait_started_at': self.start_time.isoformat(),
+            'wait_ended_at': end_time.isoformat(),
+            'wall_clock_seconds': seconds_between(self.start_time, end_time),
+            'cluster_created_at': isoformat(timeline.get('CreationDateTime')),
+            'cluster_ready_at': isoformat(timeline.get('ReadyDateTime')),
+            'cluster_ended_at': isoformat(timeline.get('EndDateTime')),
+            'phases': {
+                'provisioning_seconds': self.phase_duration('STARTING'),
+                'bootstrapping_seconds': self.phase_duration('BOOTSTRAPPING'),
+                'startup_seconds': seconds_between(timeline.get('CreationDateTime'), first_step_start),
+                'processing_seconds': seconds_between(first_step_start, last_step_end),
+                'step_seconds_total': round(sum(s['duration_seconds'] or 0 for s in steps), 1),
+            },
+            'cluster_transitions': [
+                {'state': t['state'], 'observed_at': t['observed_at'].isoformat()} for t in self.cluster_transitions
+            ],
+            'steps': steps,
+        }
+
+def write_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    phases = report['phases']
+    logger.info(f"Startup: {phases['startup_seconds']}s "
+                f"(provisioning {phases['provisioning_seconds']}s, bootstrapping {phases['bootstrapping_seconds']}s), "
+                f"processing: {phases['processing_seconds']}s")
+    logger.info(f"Timeline report written to {path}")
+
+def processing_steps(cluster_config, input_path=None):
+    """Steps from the cluster config, made safe to run on a shared cluster.
+
+    A failed step must not take the warm cluster down with it, and the input
+    path (the last spark-submit argument) can be overridden per run.
+    """
+    steps = copy.deepcopy(cluster_config.get('Steps', []))
+    for step in steps:
+        step['ActionOnFailure'] = 'CONTINUE'
+        if input_path:
+            step['HadoopJarStep']['Args'][-1] = input_path
+    return steps
+
+def find_warm_cluster(emr, tag=WARM_CLUSTER_TAG):
+    """Return the ID of an idle (WAITING) cluster carrying the warm tag, or None"""
+    paginator = emr.get_paginator('list_clusters')
+    for page in paginator.paginate(ClusterStates=['WAITING']):
+        for summary in page['Clusters']:
+            cluster = emr.describe_cluster(ClusterId=summary['Id'])['Cluster']
+            if tag in cluster.get('Tags', []):
+                return cluster['Id']
+    return None
+
+def create_warm_cluster(emr, cluster_config, idle_timeout=DEFAULT_IDLE_TIMEOUT, tag=WARM_CLUSTER_TAG):
+    """Start a long-running cluster with no steps that EMR terminates after idle_timeout seconds"""
+    config = copy.deepcopy(cluster_config)
+    config.pop('Steps', None)
+    config['Name'] = f"{config['Name']} (warm)"
+    config['Instances']['KeepJobFlowAliveWhenNoSteps'] = True
+    config['AutoTerminationPolicy'] = {'IdleTimeout': idle_timeout}
+    config['Tags'] = [t for t in config.get('Tags', []) if t['Key'] != tag['Key']] + [tag]
+    return emr.run_job_flow(**config)['JobFlowId']
+
+def acquire_warm_cluster(emr, cluster_config, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    cluster_id = find_warm_cluster(emr)
+    if cluster_id:
+        logger.info(f"Reusing warm cluster {cluster_id}")
+    else:
+        logger.info(f"No idle warm cluster found, creating one (idle timeout {idle_timeout}s)...")
+        cluster_id = create_warm_cluster(emr, cluster_config, idle_timeout)
+        logger.info(f"Created warm cluster with ID: {cluster_id}")
+    return cluster_id
+
+def run_on_warm_cluster(config_path='cluster_config.json', input_path=None, report_path=None,
+                        idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """Submit the processing step to an idle warm cluster, creating one if needed,
+    and wait for that step only. The cluster keeps running for the next batch.
+    """
+    try:
+        with open(config_path, 'r') as f:
+            cluster_config = json.load(f)
+
+        emr = boto3.client('emr', region_name='us-east-1')
+        start_time = datetime.now(timezone.utc)
+
+        cluster_id = acquire_warm_cluster(emr, cluster_config, idle_timeout)
+        response = emr.add_job_flow_steps(JobFlowId=cluster_id, Steps=processing_steps(cluster_config, input_path))
+        step_ids = response['StepIds']
+        logger.info(f"Submitted steps {step_ids} to cluster {cluster_id}")
+
+        report = ClusterWaiter(emr, cluster_id, step_ids, start_time).wait(until_steps_done=True)
+        for step in report['steps']:
+            logger.info(f"Step {step['id']} {step['state']} in {step['duration_seconds']}s")
+        write_report(report, report_path or f"step_report_{step_ids[0]}.json")
+
+        return cluster_id, step_ids
+
+    except Exception as e:
+        logger.error(f"Error running steps on warm cluster: {str(e)}")
+        raise
+
+def split_s3_path(path):
+    scheme, sep, rest = path.partition('://')
+    if not sep or scheme not in ('s3', 's3a', 's3n'):
+        raise ValueError(f"Not an S3 path: {path}")
+    bucket, _, key = rest.partition('/')
+    return bucket, key
+
+def shard_input(s3, input_path, shards):
+    """Split the data files under an S3 input prefix into at most `shards`
+    groups of similar total size. Returns one list of S3 paths per group.
+    """
+    bucket, prefix = split_s3_path(input_path)
+    objects = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            name = obj['Key'].rsplit('/', 1)[-1]
+            # Skip directory markers, _SUCCESS markers, hidden and CRC files
+            if name and not name.startswith(('_', '.')):
+                objects.append((obj['Key'], obj['Size']))
+    if not objects:
+        raise ValueError(f"No input files found at {input_path}")
+
+    # Largest file first into the currently smallest group
+    groups = [[] for _ in range(min(shards, len(objects)))]
+    sizes = [0] * len(groups)
+    for key, size in sorted(objects, key=lambda obj: obj[1], reverse=True):
+        smallest = sizes.index(min(sizes))
+        groups[smallest].append(f"s3://{bucket}/{key}")
+        sizes[smallest] += size
+    return [sorted(group) for group in groups]
+
+def sharded_steps(cluster_config, shards, summary_paths, results_paths, checkpoint_path):
+    """One copy of the configured processing step per shard.
+
+    Each step gets its shard's files as input and, through the YARN
+    application master environment, its own summary and results paths. All
+    shards share one checkpoint so a rerun skips IDs whichever shard did them.
+    """
+    base = cluster_config['Steps'][0]
+    args = base['HadoopJarStep']['Args']
+    script_index = next(i for i, arg in enumerate(args) if arg.endswith('.py'))
+    steps = []
+    for i, files in enumerate(shards):
+        env = {
+            'SUMMARY_PATH': summary_paths[i],
+            'RESULTS_PATH': results_paths[i],
+            'CHECKPOINT_PATH': checkpoint_path,
+        }
+        conf = [arg for name, value in env.items() for arg in ('--conf', f"spark.yarn.appMasterEnv.{name}={value}")]
+        step = copy.deepcopy(base)
+        step['Name'] = f"{base['Name']} (shard {i + 1}/{len(shards)})"
+        step['ActionOnFailure'] = 'CONTINUE'
+        step['HadoopJarStep']['Args'] = args[:script_index] + conf + [args[script_index]] + files
+        steps.append(step)
+    return steps
+
+def histogram_percentile(bounds, counts, percentile):
+    """Upper bound in ms of the bucket holding the given percentile (0-100)"""
+    total = sum(counts)
+    if total == 0:
+        return 0.0
+    rank = total * percentile / 100
+    cumulative = 0
+    for i, count in enumerate(counts):
+        cumulative += count
+        if cumulative >= rank:
+            return bounds[min(i, len(bounds) - 1)]
+    return bounds[-1]
+
+def merge_summaries(summaries):
+    """Combine per-step processor run summaries into one for the whole input.
+
+    Counts and latency histograms are summed, so the percentiles are those of
+    all requests rather than an average of per-step percentiles.
+    """
+    start_time = min(datetime.fromisoformat(s['start_time']) for s in summaries)
+    end_time = max(datetime.fromisoformat(s['end_time']) for s in summaries)
+    duration = (end_time - start_time).total_seconds()
+    successful = sum(s['successful'] for s in summaries)
+    failed = sum(s['failed'] for s in summaries)
+    processed = successful + failed
+    bounds = summaries[0]['latency_histogram']['bucket_upper_bounds_ms']
+    counts = [sum(bucket) for bucket in zip(*(s['latency_histogram']['counts'] for s in summaries))]
+    total_latency_ms = sum(s['latency_ms']['mean'] * s['processed'] for s in summaries)
+    return {
+        'start_time': start_time.isoformat(),
+        'end_time': end_time.isoformat(),
+        'duration_seconds': round(duration, 3),
+        'steps': len(summaries),
+        'processed': processed,
+        'successful': successful,
+        'failed': failed,
+        'throughput_per_second': round(processed / duration, 3) if duration > 0 else 0.0,
+        'latency_ms': {
+            'mean': round(total_latency_ms / processed, 3) if processed else 0.0,
+            'p50': histogram_percentile(bounds, counts, 50),
+            'p95': histogram_percentile(bounds, counts, 95),
+            'p99': histogram_percentile(bounds, counts, 99),
+        },
+        'latency_histogram': {
+            'bucket_upper_bounds_ms': bounds,
+            'counts': counts,
+        },
+        'input_paths': [s.get('input_path') for s in summaries],
+        'results_paths': [s.get('results_path') for s in summaries],
+    }
+
+def read_summaries(s3, summary_paths):
+    """Load the run summaries that exist; a failed step leaves none behind"""
+    summaries = []
+    for path in summary_paths:
+        bucket, key = split_s3_path(path)
+        try:
+            body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            logger.warning(f"No run summary at {path}")
+            continue
+        summaries.append(json.loads(body))
+    return summaries
+
+def run_sharded(config_path='cluster_config.json', input_path=None, shards=4, step_concurrency=None,
+                report_path=None, warm=False, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """Split the input into shards, run one processing step per shard with
+    concurrent step execution, and merge the steps' run summaries.
+    """
+    try:
+        with open(config_path, 'r') as f:
+            cluster_config = json.load(f)
+
+        emr = boto3.client('emr', region_name='us-east-1')
+        s3 = boto3.client('s3')
+        start_time = datetime.now(timezone.utc)
+        run_id = start_time.strftime('%Y%m%d_%H%M%S')
+
+        input_path = input_path or cluster_config['Steps'][0]['HadoopJarStep']['Args'][-1]
+        groups = shard_input(s3, input_path, shards)
+        if len(groups) < shards:
+            logger.warning(f"{input_path} has only {len(groups)} file(s), running {len(groups)} step(s)")
+        log_uri = cluster_config['LogUri'].rstrip('/')
+        summary_paths = [f"{log_uri}/processor_summaries/run_{run_id}/shard-{i:05d}.json" for i in range(len(groups))]
+        results_paths = [f"{log_uri}/processor_results/run_{run_id}/shard-{i:05d}/" for i in range(len(groups))]
+        bucket, prefix = split_s3_path(input_path)
+        checkpoint_path = f"s3://{bucket}/checkpoints/{prefix.rstrip('/').rsplit('/', 1)[-1].split('.', 1)[0]}/"
+        steps = sharded_steps(cluster_config, groups, summary_paths, results_paths, checkpoint_path)
+        concurrency = min(step_concurrency or len(steps), len(steps), MAX_STEP_CONCURRENCY)
+        logger.info(f"Split {input_path} into {len(steps)} shard(s), running {concurrency} at a time")
+
+        if warm:
+            cluster_id = acquire_warm_cluster(emr, cluster_config, idle_timeout)
+            emr.modify_cluster(ClusterId=cluster_id, StepConcurrencyLevel=concurrency)
+            step_ids = emr.add_job_flow_steps(JobFlowId=cluster_id, Steps=steps)['StepIds']
+            logger.info(f"Submitted steps {step_ids} to cluster {cluster_id}")
+            report = ClusterWaiter(emr, cluster_id, step_ids, start_time).wait(until_steps_done=True)
+        else:
+            config = dict(cluster_config, Steps=steps, StepConcurrencyLevel=concurrency)
+            logger.info("Creating EMR cluster...")
+            cluster_id = emr.run_job_flow(**config)['JobFlowId']
+            logger.info(f"Created cluster with ID: {cluster_id}")
+            report = ClusterWaiter(emr, cluster_id, start_time=start_time).wait()
+
+        for step in report['steps']:
+            logger.info(f"Step {step['id']} ({step['name']}) {step['state']} in {step['duration_seconds']}s")
+
+        summaries = read_summaries(s3, summary_paths)
+        if summaries:
+            merged = merge_summaries(summaries)
+            merged_path = f"{log_uri}/processor_summaries/run_{run_id}/merged.json"
+            bucket, key = split_s3_path(merged_path)
+            s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(merged, indent=2).encode('utf-8'))
+            logger.info(f"Merged {len(summaries)}/{len(steps)} step summaries: {merged['processed']} processed, "
+                        f"{merged['throughput_per_second']} IDs/s, p99 {merged['latency_ms']['p99']} ms")
+            logger.info(f"Wrote merged summary to {merged_path}")
+            report['summary'] = {k: v for k, v in merged.items() if k != 'latency_histogram'}
+        write_report(report, report_path or f"sharded_report_{run_id}.json")
+
+        return cluster_id, report
+
+    except Exception as e:
+        logger.error(f"Error running sharded steps: {str(e)}")
+        raise
+
+def run_emr_cluster(config_path='cluster_config.json', report_path=None):
     try:
         # Load cluster configuration
-        with open('cluster_config.json', 'r') as f:
+        with open(config_path, 'r') as f:
             cluster_config = json.load(f)
-            
+
         # Create EMR client
         emr = boto3.client('emr', region_name='us-east-1')
-        
+
         # Create cluster
         logger.info("Creating EMR cluster...")
-        start_time = datetime.now()
+        start_time = datetime.now(timezone.utc)
         response = emr.run_job_flow(**cluster_config)
         cluster_id = response['JobFlowId']
         logger.info(f"Created cluster with ID: {cluster_id}")
-        
-        # Wait for cluster to complete
-        while True:
-            response = emr.describe_cluster(ClusterId=cluster_id)
-            status = response['Cluster']['Status']['State']
-            
-            if status in ['TERMINATED', 'TERMINATED_WITH_ERRORS']:
-                end_time = datetime.now()
-                duration = end_time - start_time
-                logger.info(f"Cluster {status}")
-                logger.info(f"Total duration: {duration}")
-                break
-                
-            logger.info(f"Cluster status: {status}")
-            time.sleep(30)  # Check every 30 seconds
-            
+
+        # Wait for cluster to complete, tracking its steps
+        report = ClusterWaiter(emr, cluster_id, start_time=start_time).wait()
+        logger.info(f"Cluster {report['final_state']}")
+        logger.info(f"Total duration: {report['wall_clock_seconds']}s")
+        write_report(report, report_path or f"cluster_report_{cluster_id}.json")
+
         return cluster_id
-        
+
     except Exception as e:
         logger.error(f"Error running EMR cluster: {str(e)}")
         raise
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the ID processing EMR cluster and report its timeline")
+    parser.add_argument('--config', default='cluster_config.json', help='run_job_flow configuration file')
+    parser.add_argument('--report', help='Timeline report path (default: cluster_report_<cluster id>.json)')
+    parser.add_argument('--warm', action='store_true',
+                        help='Submit the step to an idle tagged cluster (creating one if needed) instead of '
+                             'starting a new cluster')
+    parser.add_argument('--idle-timeout', type=int, default=DEFAULT_IDLE_TIMEOUT,
+                        help='Seconds a newly created warm cluster may sit idle before auto-termination')
+    parser.add_argument('--input', help='Override the input path of the processing step (warm and sharded modes)')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Split the files under the input prefix into this many concurrent steps')
+    parser.add_argument('--step-concurrency', type=int,
+                        help='Steps the cluster runs at once in sharded mode (default: one per shard)')
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    run_emr_cluster()
+    args = parse_args()
+    if args.shards > 1:
+        run_sharded(args.config, args.input, args.shards, args.step_concurrency, args.report,
+                    args.warm, args.idle_timeout)
+    elif args.warm:
+        run_on_warm_cluster(args.config, args.input, args.report, args.idle_timeout)
+    else:
+        run_emr_cluster(args.config, args.report)
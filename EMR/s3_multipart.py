@@ -0,0 +1,118 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+S3_MIN_PART_SIZE = 5 * 1024 * 1024  # S3 rejects smaller non-final parts
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+class MultipartUploader:
+    """File-like writer that streams bytes into an S3 multipart upload.
+
+    Written data is buffered until a full part is available and parts are
+    uploaded on a thread pool. At most `max_concurrency` parts are in flight,
+    and write() blocks while they are, so memory stays at roughly
+    part_size * (max_concurrency + 1) however much is written. Objects smaller
+    than one part are uploaded with a single put_object on close().
+    """
+    def __init__(self, s3, bucket, key, part_size=DEFAULT_PART_SIZE, max_concurrency=4):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, S3_MIN_PART_SIZE)
+        self.bytes_written = 0
+        self.closed = False
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit(part)
+        return len(data)
+
+    def _submit(self, body):
+        if self._upload_id is None:
+            response = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+            self._upload_id = response['UploadId']
+        for future in self._futures:
+            if future.done() and future.exception():
+                raise future.exception()
+        self._slots.acquire()
+        part_number = len(self._futures) + 1
+        self._futures.append(self._executor.submit(self._upload_part, part_number, body))
+
+    def _upload_part(self, part_number, body):
+        try:
+            response = self.s3.upload_part(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+                Body=body
+            )
+            return {'ETag': response['ETag'], 'PartNumber': part_number}
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Upload any buffered data and complete the upload"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._upload_id is None:
+                self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+                return
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+            parts = [future.result() for future in self._futures]
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._executor.shutdown(wait=True)
+            self._buffer = bytearray()
+
+    def abort(self):
+        """Abort the multipart upload so no orphaned parts are left behind"""
+        self.closed = True
+        self._executor.shutdown(wait=True)
+        if self._upload_id is None:
+            return
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+        except Exception as e:
+            logger.error(f"Failed to abort multipart upload of s3://{self.bucket}/{self.key}: {str(e)}")
+        self._upload_id = None
@@ -1,43 +1,301 @@
-import requests
-import time
-import statistics
+import argparse
+import http.client
 import json
+import queue
+import random
+import select
+import socket
+import ssl
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urlsplit
+
+DEFAULT_URL = "https://o33gysuh1e.execute-api.us-east-1.amazonaws.com/prod/risk-profile"
+PHASES = ['dns', 'connect', 'tls', 'ttfb', 'total', 'queue']
+PERCENTILES = [50, 75, 90, 95, 99, 99.9]
+
+class LatencyHistogram:
+    """HDR-style histogram of microsecond values.
+
+    Values are rounded down to SUB_BITS significant bits (under 1% relative
+    error), so memory depends on the value range rather than the sample count.
+    """
+    SUB_BITS = 8
+
+    def __init__(self):
+        self.counts = Counter()
+        self.count = 0
+        self.max = 0
+
+    def record(self, seconds):
+        value = int(seconds * 1_000_000)
+        shift = max(0, value.bit_length() - self.SUB_BITS)
+        self.counts[(value >> shift) << shift] += 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile):
+        """Value in ms at the given percentile (0-100)"""
+        if self.count == 0:
+            return 0.0
+        rank = self.count * percentile / 100
+        cumulative = 0
+        for value in sorted(self.counts):
+            cumulative += self.counts[value]
+            if cumulative >= rank:
+                return value / 1000
+        return self.max / 1000
+
+    def summary(self):
+        result = {f"p{p:g}": round(self.percentile(p), 3) for p in PERCENTILES}
+        result['max'] = round(self.max / 1000, 3)
+        result['count'] = self.count
+        return result
+
+class WorkerStats:
+    """Per-thread results, merged once the run ends to avoid locking"""
+    def __init__(self):
+        self.histograms = {phase: LatencyHistogram() for phase in PHASES}
+        self.status_codes = Counter()
+        self.errors = Counter()
+
+    def merge(self, other):
+        for phase in PHASES:
+            self.histograms[phase].merge(other.histograms[phase])
+        self.status_codes.update(other.status_codes)
+        self.errors.update(other.errors)
+
+class TimedConnection:
+    """Minimal HTTP/1.1 client that times DNS, connect, TLS and first byte separately"""
+    def __init__(self, url, timeout, keep_alive):
+        parts = urlsplit(url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.https else 80)
+        self.path = parts.path or '/'
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.ssl_context = ssl.create_default_context() if self.https else None
+        self.sock = None
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
 
-def test_api():
-    url = "https://o33gysuh1e.execute-api.us-east-1.amazonaws.com/prod/risk-profile"
+    def _open(self, timings):
+        start = time.perf_counter()
+        family, socktype, proto, _, address = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)[0]
+        resolved = time.perf_counter()
+        # Held on self.sock from the start so close() releases it if connect or the handshake fails
+        self.sock = socket.socket(family, socktype, proto)
+        self.sock.settimeout(self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.connect(address)
+        connected = time.perf_counter()
+        timings.update(dns=resolved - start, connect=connected - resolved)
+        if self.https:
+            self.sock = self.ssl_context.wrap_socket(self.sock, server_hostname=self.host)
+            timings['tls'] = time.perf_counter() - connected
+
+    def post(self, body):
+        """Send one POST and return (status, timings in seconds).
+
+        dns, connect and (for https) tls are only timed on requests that
+        opened a new connection; requests reusing a keep-alive connection
+        leave them out rather than recording zeros.
+        """
+        timings = {}
+        start = time.perf_counter()
+        request = (
+            f"POST {self.path} HTTP/1.1\r\n"
+            f"Host: {self.host}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if self.keep_alive else 'close'}\r\n\r\n"
+        ).encode('ascii') + body
+        try:
+            if self.sock is None:
+                self._open(timings)
+            self.sock.sendall(request)
+            readable, _, _ = select.select([self.sock], [], [], self.timeout)
+            if not readable:
+                raise socket.timeout("timed out waiting for the first response byte")
+            first_byte = time.perf_counter()
+            response = http.client.HTTPResponse(self.sock)
+            response.begin()
+            response.read()
+        except Exception:
+            self.close()
+            raise
+        end = time.perf_counter()
+        timings.update(ttfb=first_byte - start, total=end - start)
+        if not self.keep_alive or response.will_close:
+            self.close()
+        return response.status, timings
+
+def arrival_times(start, rate, arrival, deadline, max_requests):
+    """Yield scheduled send times for an open-loop run"""
+    scheduled = start
+    sent = 0
+    while scheduled < deadline and (max_requests is None or sent < max_requests):
+        yield scheduled
+        sent += 1
+        interval = random.expovariate(rate) if arrival == 'poisson' else 1 / rate
+        scheduled += interval
+
+def run_load_test(url, payload, concurrency=10, duration=10.0, max_requests=None, rate=0.0,
+                  arrival='constant', keep_alive=True, timeout=30.0):
+    """Run a load test and return the results document.
+
+    With rate=0 the test is closed-loop: each of `concurrency` threads sends
+    its next request as soon as the previous one completes. With rate>0 it is
+    open-loop: requests are scheduled at `rate` per second (evenly spaced or
+    Poisson) regardless of how fast responses come back, and the `queue`
+    phase records how long each request waited for a free connection.
+    """
+    body = json.dumps(payload).encode('utf-8')
+    started_at = datetime.now()
+    start = time.perf_counter()
+    deadline = start + duration
+    work = queue.Queue(maxsize=concurrency * 4) if rate > 0 else None
+    issued = Counter()
+    issued_lock = threading.Lock()
+    worker_stats = []
+
+    def claim():
+        """Closed loop: reserve the next request slot, False when the run is over"""
+        with issued_lock:
+            if time.perf_counter() >= deadline or (max_requests is not None and issued['n'] >= max_requests):
+                return False
+            issued['n'] += 1
+            return True
+
+    def worker():
+        stats = WorkerStats()
+        worker_stats.append(stats)
+        connection = TimedConnection(url, timeout, keep_alive)
+        try:
+            while True:
+                if work is not None:
+                    scheduled = work.get()
+                    if scheduled is None:
+                        break
+                    queued = max(0.0, time.perf_counter() - scheduled)
+                elif not claim():
+                    break
+                try:
+                    status, timings = connection.post(body)
+                except Exception as e:
+                    stats.errors[type(e).__name__] += 1
+                    continue
+                stats.status_codes[status] += 1
+                if work is not None:
+                    timings['queue'] = queued
+                for phase, seconds in timings.items():
+                    stats.histograms[phase].record(seconds)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    if work is not None:
+        for scheduled in arrival_times(start, rate, arrival, deadline, max_requests):
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            work.put(scheduled)
+        for _ in threads:
+            work.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    totals = WorkerStats()
+    for stats in worker_stats:
+        totals.merge(stats)
+    completed = sum(totals.status_codes.values())
+    return {
+        'config': {
+            'url': url,
+            'concurrency': concurrency,
+            'duration_seconds': duration,
+            'max_requests': max_requests,
+            'rate_per_second': rate,
+            'arrival': arrival if rate > 0 else 'closed-loop',
+            'keep_alive': keep_alive,
+            'timeout_seconds': timeout,
+        },
+        'started_at': started_at.isoformat(),
+        'elapsed_seconds': round(elapsed, 3),
+        'completed': completed,
+        'errors': dict(totals.errors),
+        'status_codes': {str(code): count for code, count in totals.status_codes.items()},
+        'throughput_per_second': round(completed / elapsed, 3) if elapsed > 0 else 0.0,
+        'latency_ms': {phase: totals.histograms[phase].summary() for phase in PHASES},
+    }
+
+def print_report(results):
+    print(f"\nCompleted {results['completed']} requests in {results['elapsed_seconds']:.2f}s "
+          f"({results['throughput_per_second']:.2f} req/s)")
+    print(f"Status codes: {results['status_codes']}")
+    if results['errors']:
+        print(f"Errors: {results['errors']}")
+    header = ''.join(f"{name:>10}" for name in [f"p{p:g}" for p in PERCENTILES] + ['max', 'samples'])
+    print(f"\n{'phase (ms)':<12}{header}")
+    for phase in PHASES:
+        summary = results['latency_ms'][phase]
+        if summary['count'] == 0:
+            continue  # tls over plain http, queue in closed-loop runs
+        values = ''.join(f"{summary[f'p{p:g}']:>10.2f}" for p in PERCENTILES) + \
+            f"{summary['max']:>10.2f}{summary['count']:>10}"
+        print(f"{phase:<12}{values}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the risk-profile endpoint")
+    parser.add_argument('--url', default=DEFAULT_URL, help='Endpoint to target, e.g. a local mock server')
+    parser.add_argument('--concurrency', type=int, default=10, help='Concurrent connections')
+    parser.add_argument('--duration', type=float, default=10.0, help='Test duration in seconds')
+    parser.add_argument('--requests', type=int, help='Stop after this many requests')
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='Open-loop arrival rate in requests/second (0 runs closed-loop)')
+    parser.add_argument('--arrival', default='constant', choices=['constant', 'poisson'],
+                        help='Open-loop arrival process')
+    parser.add_argument('--no-keep-alive', action='store_true', help='Open a new connection per request')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Per-request socket timeout in seconds')
+    parser.add_argument('--output', default='load_test_results.json', help='Where to write the JSON results')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
     payload = {"risk_profile_id": "test-123"}
-    response_times = []
-    dns_times = []
-    connect_times = []
-    
-    print("Testing API with 10 requests...")
-    print(f"Sending payload: {json.dumps(payload, indent=2)}\n")
-    
-    session = requests.Session()  # Use session to reuse connections
-    
-    for i in range(10):
-        start_time = time.time()
-        response = session.post(url, json=payload)
-        end_time = time.time()
-        
-        response_time = (end_time - start_time) * 1000  # Convert to milliseconds
-        response_times.append(response_time)
-        
-        print(f"Request {i+1}:")
-        print(f"Response Time: {response_time:.2f}ms")
-        print(f"Status Code: {response.status_code}")
-        print(f"Response Headers: {dict(response.headers)}")
-        print(f"Response Body: {json.dumps(response.json(), indent=2)}\n")
-        
-        # Add a small delay between requests
-        time.sleep(0.1)
-    
-    avg_time = statistics.mean(response_times)
-    print("\nTiming Statistics:")
-    print(f"Average Response Time: {avg_time:.2f}ms")
-    print(f"Min Response Time: {min(response_times):.2f}ms")
-    print(f"Max Response Time: {max(response_times):.2f}ms")
-    print(f"Standard Deviation: {statistics.stdev(response_times):.2f}ms")
+    mode = f"open-loop at {args.rate}/s ({args.arrival})" if args.rate > 0 else "closed-loop"
+    print(f"Load testing {args.url} with {args.concurrency} connections, {mode}")
+    print(f"Sending payload: {json.dumps(payload)}")
+
+    results = run_load_test(
+        args.url,
+        payload,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        max_requests=args.requests,
+        rate=args.rate,
+        arrival=args.arrival,
+        keep_alive=not args.no_keep_alive,
+        timeout=args.timeout
+    )
+    print_report(results)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
 
 if __name__ == "__main__":
-    test_api()
+    main()
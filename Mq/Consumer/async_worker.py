@@ -0,0 +1,247 @@
+import asyncio
+import json
+import os
+import signal
+import ssl
+import time
+
+import aio_pika
+import aiohttp
+
+from common.config import MQ_HOST, MQ_PORT, MQ_TLS, MQ_VHOST, PASSWORD, QUEUE_NAME, USERNAME
+from common.logs import SampledLogger, setup_logging
+from common.metrics import BacklogGauges, Metrics, start_reporting
+from common.reconnect import (RECONNECT_INITIAL_DELAY, RECONNECT_MAX_ATTEMPTS, DowntimeTracker,
+                              backoff_delay)
+from common.retry import RetryPolicy
+
+# Messages processed concurrently, and unacknowledged messages the broker may push
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "100"))
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", "0")) or MAX_CONCURRENCY
+
+# Risk-profile endpoint to post each ID to; unset simulates processing
+API_GATEWAY_URL = os.getenv("API_GATEWAY_URL")
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "30"))  # seconds to let in-flight messages finish
+
+logger = setup_logging(__name__)
+message_log = SampledLogger(logger)
+
+async def post_risk_profile(session, customer_id):
+    async with session.post(API_GATEWAY_URL, json={"risk_profile_id": customer_id["id"]}) as response:
+        response.raise_for_status()
+        return await response.json()
+
+async def process_message(session, body):
+    """Post every ID in the message (a single {"id": n} or a list of them) concurrently"""
+    if API_GATEWAY_URL is None:
+        await asyncio.sleep(0.01)  # Simulating 10ms processing delay
+        return {"processed": body}
+    customer_ids = body if isinstance(body, list) else [body]
+    results = await asyncio.gather(*(post_risk_profile(session, customer_id) for customer_id in customer_ids))
+    return {"processed": results}
+
+class AsyncWorker:
+    """Consumes the queue on asyncio, processing up to MAX_CONCURRENCY messages at once.
+
+    Each delivery is handled in its own task behind a semaphore and acked
+    only after processing succeeds; failures are republished to a retry
+    queue or the dead-letter exchange (see RetryPolicy) and then acked. On
+    SIGTERM/SIGINT the consumer is cancelled and in-flight messages get
+    SHUTDOWN_TIMEOUT seconds to finish before the connection closes (anything
+    unacknowledged is redelivered by the broker).
+
+    The robust connection re-establishes itself after a connection loss,
+    redeclaring the queues and exchanges and resuming the consumer; messages
+    in flight at that moment cannot be settled and are redelivered.
+    """
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, prefetch_count=PREFETCH_COUNT):
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.prefetch_count = prefetch_count
+        self.tasks = set()
+        self.in_flight = 0
+        self.stopping = asyncio.Event()
+        self.session = None
+        self.retry_policy = RetryPolicy(QUEUE_NAME)
+        self.channel = None
+        self.dead_letter_exchange = None
+        self.metrics = Metrics(labels={"queue": QUEUE_NAME, "worker": "async_consumer"})
+        self.downtime = DowntimeTracker(self.metrics)
+
+    async def on_message(self, message):
+        task = asyncio.ensure_future(self.handle(message))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def handle(self, message):
+        received_at = time.monotonic()
+        self.metrics.inc("messages_received")
+        async with self.semaphore:
+            self.in_flight += 1
+            self.metrics.set("messages_in_flight", self.in_flight)
+            try:
+                try:
+                    customer_id = json.loads(message.body)
+                    result = await process_message(self.session, customer_id)
+                except Exception as e:
+                    await self.retry_or_dead_letter(message, e)
+                    self.metrics.inc("messages_failed")
+                    logger.warning("Error processing message: %s", e)
+                else:
+                    await message.ack()
+                    self.metrics.inc("messages_acked")
+                    message_log.log("Processed result: %s", result)
+            except aio_pika.exceptions.CONNECTION_EXCEPTIONS as e:
+                logger.warning("Could not settle message, it will be redelivered: %r", e)
+            except Exception:
+                # e.g. the channel was closed; nobody awaits this task, so log it here
+                logger.exception("Could not settle message, it will be redelivered")
+            finally:
+                self.in_flight -= 1
+                self.metrics.set("messages_in_flight", self.in_flight)
+                self.metrics.observe("message_latency", time.monotonic() - received_at)
+
+    async def retry_or_dead_letter(self, message, error):
+        """Republish a failed message to its retry queue or the dead-letter exchange, then ack it.
+
+        A ValueError (including an undecodable body) is dead-lettered at once.
+        The channel uses publisher confirms, so the copy is on the broker
+        before the original is acked; if the broker refuses it the original
+        is requeued.
+        """
+        exchange_name, routing_key, headers, dead = self.retry_policy.next_destination(
+            message.headers, error, permanent=isinstance(error, ValueError)
+        )
+        exchange = self.dead_letter_exchange if exchange_name else self.channel.default_exchange
+        try:
+            await exchange.publish(
+                aio_pika.Message(message.body, headers=headers, content_type=message.content_type,
+                                 delivery_mode=aio_pika.DeliveryMode.PERSISTENT),
+                routing_key=routing_key
+            )
+        except aio_pika.exceptions.DeliveryError:
+            await message.nack(requeue=True)
+            return
+        await message.ack()
+        self.metrics.inc("messages_dead_lettered" if dead else "messages_retried")
+
+    async def sample_queue(self, channel, backlog):
+        """Refresh the backlog gauges every QUEUE_STATS_INTERVAL seconds until stopped.
+
+        `channel` must be one the queue was not declared on: a robust channel
+        answers a passive declare of a queue it already holds from its cache,
+        without asking the broker, and robust=False keeps this declare out of
+        that cache.
+        """
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=backlog.interval)
+            except asyncio.TimeoutError:
+                try:
+                    declared = await channel.declare_queue(QUEUE_NAME, passive=True, robust=False)
+                except aio_pika.exceptions.CONNECTION_EXCEPTIONS:
+                    continue  # reconnecting; sample again next interval
+                backlog.update(declared.declaration_result.message_count,
+                               declared.declaration_result.consumer_count)
+
+    def stop(self):
+        self.stopping.set()
+
+    def on_connection_lost(self, connection, error):
+        if not self.stopping.is_set():
+            logger.warning("Connection lost: %r", error)
+            self.downtime.disconnected()
+
+    def on_reconnected(self, connection):
+        downtime = self.downtime.connected()
+        if downtime is not None:
+            logger.info("Reconnected to %s:%s after %.1fs", MQ_HOST, MQ_PORT, downtime)
+
+    async def connect(self):
+        """Open a robust connection, retrying with jittered backoff while the broker is unreachable.
+
+        Later reconnects are aio-pika's, every RECONNECT_INITIAL_DELAY seconds.
+        Returns None if the worker is stopped before a connection is made.
+        """
+        attempt = 0
+        while True:
+            try:
+                connection = await aio_pika.connect_robust(
+                    host=MQ_HOST,
+                    port=MQ_PORT,
+                    login=USERNAME,
+                    password=PASSWORD,
+                    virtualhost=MQ_VHOST,
+                    ssl=MQ_TLS,
+                    ssl_context=ssl.create_default_context() if MQ_TLS else None,
+                    reconnect_interval=RECONNECT_INITIAL_DELAY
+                )
+            except aio_pika.exceptions.CONNECTION_EXCEPTIONS as e:
+                attempt += 1
+                self.downtime.disconnected()
+                if RECONNECT_MAX_ATTEMPTS and attempt > RECONNECT_MAX_ATTEMPTS:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning("Connecting to %s:%s failed (%r); retry %d in %.1fs", MQ_HOST, MQ_PORT, e, attempt, delay)
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), timeout=delay)
+                    return None
+                except asyncio.TimeoutError:
+                    continue
+            self.on_reconnected(connection)
+            connection.close_callbacks.add(self.on_connection_lost)
+            connection.reconnect_callbacks.add(self.on_reconnected)
+            return connection
+
+    async def run(self):
+        connection = await self.connect()
+        if connection is None:
+            return
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        reporter = None
+        try:
+            async with connection, aiohttp.ClientSession(timeout=timeout, connector=connector) as self.session:
+                channel = self.channel = await connection.channel()
+                await channel.set_qos(prefetch_count=self.prefetch_count)
+                queue = await channel.declare_queue(QUEUE_NAME, durable=True)
+                await self.retry_policy.declare_async(channel)
+                self.dead_letter_exchange = await channel.get_exchange(self.retry_policy.dead_letter_exchange)
+                consumer_tag = await queue.consume(self.on_message)
+                logger.info(f"Async worker started (concurrency {self.max_concurrency}, "
+                            f"prefetch {self.prefetch_count}). Waiting for messages...")
+                reporter = start_reporting(self.metrics)
+                backlog = BacklogGauges(self.metrics)
+                sampler = None
+                if backlog.interval > 0:
+                    stats_channel = await connection.channel()
+                    sampler = asyncio.ensure_future(self.sample_queue(stats_channel, backlog))
+
+                await self.stopping.wait()
+                if sampler:
+                    await sampler
+                logger.info("Stopping: cancelling consumer and finishing in-flight messages...")
+                await queue.cancel(consumer_tag)
+                if self.tasks:
+                    _, pending = await asyncio.wait(self.tasks, timeout=SHUTDOWN_TIMEOUT)
+                    if pending:
+                        logger.warning(f"{len(pending)} message(s) still in flight after {SHUTDOWN_TIMEOUT}s; "
+                                       f"they will be redelivered")
+                        for task in pending:
+                            task.cancel()
+        finally:
+            if reporter:
+                reporter.stop()
+        logger.info(f"Worker stopped. Acked {self.metrics.counters['messages_acked']}, "
+                    f"failed {self.metrics.counters['messages_failed']}.")
+
+async def main():
+    worker = AsyncWorker()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    await worker.run()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,10 +1,31 @@
 #!/bin/bash
 
-# Run the worker script as 5 processes
+# WORKER_RUNTIME=async runs the asyncio consumer instead of the blocking pika worker
+if [ "$WORKER_RUNTIME" = "async" ]; then
+   worker_module=Consumer.async_worker
+else
+   worker_module=Consumer.worker
+fi
+
+# Array to store process PIDs
+pids=()
+
+# Run the worker as 5 processes (WORKER_INDEX offsets each one's METRICS_PORT)
 for i in {1..5}
 do
-   python worker.py &
+   WORKER_INDEX=$((i - 1)) python -m $worker_module &
+   pids+=($!)
 done
 
+# Bash runs as PID 1 in the container, so ECS's SIGTERM reaches only this
+# script; pass it on to the workers and wait for them to shut down
+forward_signal() {
+    kill -"$1" "${pids[@]}" 2>/dev/null
+    wait
+    exit
+}
+trap 'forward_signal TERM' SIGTERM
+trap 'forward_signal INT' SIGINT
+
 # Wait for all background processes to finish
 wait
@@ -1,68 +1,193 @@
 import pika
 import json
 import time
-import ssl
 import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 
-# Retrieve configuration from environment variables
-MQ_HOST = os.getenv("MQ_HOST", "default_host")
-QUEUE_NAME = os.getenv("QUEUE_NAME", "default_queue")
-USERNAME = os.getenv("USERNAME", "default_user")
-PASSWORD = os.getenv("PASSWORD", "default_password")
+from common.config import QUEUE_NAME, connection_parameters
+from common.logs import SampledLogger, setup_logging
+from common.metrics import BacklogGauges, Metrics, start_reporting
+from common.reconnect import ReconnectingConsumer
+from common.retry import RetryPolicy
+
+# WORKER_POOL_SIZE 0 processes messages serially on the connection thread;
+# above 0 they run on a thread or process pool (WORKER_POOL=thread|process)
+WORKER_POOL = os.getenv("WORKER_POOL", "thread")
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "0"))
+# Unacknowledged messages the broker may push; defaults to 1 serially, 2 per pool worker otherwise
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", "0")) or max(1, WORKER_POOL_SIZE * 2)
+
+logger = setup_logging(__name__)
+message_log = SampledLogger(logger)
+metrics = Metrics(labels={"queue": QUEUE_NAME, "worker": "consumer"})
+retry_policy = RetryPolicy(QUEUE_NAME)
+# Set for a graceful shutdown: on SIGTERM or Ctrl-C
+shutdown = threading.Event()
 
 def process_message(body):
     """Simulate processing"""
     time.sleep(0.01)  # Simulating 10ms processing delay
     return {"processed": body}
 
-def main():
-    # Set up credentials and SSL options for secure connection
-    credentials = pika.PlainCredentials(USERNAME, PASSWORD)
-    ssl_context = ssl.create_default_context()
-    ssl_options = pika.SSLOptions(context=ssl_context)
-
-    # Establish connection parameters
-    connection_params = pika.ConnectionParameters(
-        host=MQ_HOST,  # Extract host from URL
-        port=5671,  # AMQPS default port
-        virtual_host="/",  # Adjust as needed
-        credentials=credentials,
-        ssl_options=ssl_options
+def create_executor():
+    if WORKER_POOL_SIZE <= 0:
+        return None
+    if WORKER_POOL == "process":
+        # Ctrl-C goes to the whole process group; let the parent drain and shut the pool down
+        return ProcessPoolExecutor(max_workers=WORKER_POOL_SIZE, initializer=signal.signal,
+                                   initargs=(signal.SIGINT, signal.SIG_IGN))
+    return ThreadPoolExecutor(max_workers=WORKER_POOL_SIZE)
+
+def record_success(received_at, result):
+    metrics.inc("messages_acked")
+    metrics.observe("message_latency", time.monotonic() - received_at)
+    message_log.log("Processed result: %s", result)
+
+def record_failure(received_at, error):
+    metrics.inc("messages_failed")
+    metrics.observe("message_latency", time.monotonic() - received_at)
+    logger.warning("Error processing message: %s", error)
+
+def retry_or_dead_letter(channel, delivery_tag, properties, body, error):
+    """Republish a failed message to its retry queue or the dead-letter exchange, then ack it.
+
+    A ValueError (including an undecodable body) will not succeed on another
+    attempt and is dead-lettered at once. The channel is in confirm mode, so
+    the copy is on the broker before the original is acked; if the broker
+    refuses it the original is requeued.
+    """
+    exchange, routing_key, properties.headers, dead = retry_policy.next_destination(
+        properties.headers, error, permanent=isinstance(error, ValueError)
     )
+    try:
+        channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+    except (pika.exceptions.NackError, pika.exceptions.UnroutableError):
+        channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        return
+    channel.basic_ack(delivery_tag=delivery_tag)
+    metrics.inc("messages_dead_lettered" if dead else "messages_retried")
+
+def settle(channel, delivery_tag, properties, body, received_at, future):
+    """Ack or retry a message once its pool task is done; runs on the connection thread"""
+    if not channel.is_open:
+        return  # the broker redelivers unacknowledged messages
+    error = future.exception()
+    if error is None:
+        channel.basic_ack(delivery_tag=delivery_tag)
+        record_success(received_at, future.result())
+    else:
+        retry_or_dead_letter(channel, delivery_tag, properties, body, error)
+        record_failure(received_at, error)
+
+def request_shutdown(signum, frame):
+    shutdown.set()
+
+def main():
+    connection_params = connection_parameters()
 
-    # Connect to RabbitMQ
-    connection = pika.BlockingConnection(connection_params)
-    channel = connection.channel()
+    # ECS stops tasks with SIGTERM; finish the in-flight messages before exiting
+    signal.signal(signal.SIGTERM, request_shutdown)
 
-    # Declare the queue to ensure it exists
-    channel.queue_declare(queue=QUEUE_NAME, durable=True)
+    executor = create_executor()
+    mode = f"{WORKER_POOL_SIZE} {WORKER_POOL} workers" if executor else "serial"
 
-    def callback(ch, method, properties, body):
-        """Callback for processing messages"""
+    def consume(connection):
+        """One consuming session; ReconnectingConsumer starts a new one if the connection is lost"""
+        channel = connection.channel()
+
+        # Declare the queue to ensure it exists
+        channel.queue_declare(queue=QUEUE_NAME, durable=True)
+        retry_policy.declare(channel)
+        channel.confirm_delivery()  # retried and dead-lettered copies are confirmed before the original is acked
+
+        def submit(ch, method, properties, body):
+            """Hand the message to the pool; the ack is marshalled back to this
+            thread with add_callback_threadsafe once processing finishes
+            """
+            received_at = time.monotonic()
+            metrics.inc("messages_received")
+            try:
+                customer_id = json.loads(body)
+                future = executor.submit(process_message, customer_id)
+            except ValueError as e:
+                retry_or_dead_letter(ch, method.delivery_tag, properties, body, e)
+                record_failure(received_at, e)
+                return
+            except Exception as e:
+                # The pool is shutting down; leave the message for another consumer
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                record_failure(received_at, e)
+                return
+
+            def on_done(done):
+                try:
+                    connection.add_callback_threadsafe(
+                        partial(settle, ch, method.delivery_tag, properties, body, received_at, done)
+                    )
+                except pika.exceptions.ConnectionWrongStateError:
+                    pass  # the connection was lost; the broker redelivers the message
+
+            future.add_done_callback(on_done)
+
+        def callback(ch, method, properties, body):
+            """Callback for processing messages"""
+            received_at = time.monotonic()
+            metrics.inc("messages_received")
+            try:
+                customer_id = json.loads(body)
+                message_log.log("Received customer ID: %s", customer_id)
+                result = process_message(customer_id)
+            except Exception as e:
+                # Retry with backoff instead of requeueing at the head of the queue
+                retry_or_dead_letter(ch, method.delivery_tag, properties, body, e)
+                record_failure(received_at, e)
+            else:
+                # Acknowledge the message after successful processing
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                record_success(received_at, result)
+
+        # Start consuming messages with prefetch to handle load efficiently
+        # (prefetch also bounds the messages queued on the pool)
+        channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+        channel.basic_consume(queue=QUEUE_NAME, on_message_callback=submit if executor else callback)
+
+        backlog = BacklogGauges(metrics)
+
+        def sample_queue():
+            """Refresh the backlog gauges; runs on the connection thread between deliveries"""
+            declared = channel.queue_declare(queue=QUEUE_NAME, passive=True).method
+            backlog.update(declared.message_count, declared.consumer_count)
+            connection.call_later(backlog.interval, sample_queue)
+
+        if backlog.interval > 0:
+            connection.call_later(backlog.interval, sample_queue)
+
+        logger.info(f"Worker started ({mode}, prefetch {PREFETCH_COUNT}). Waiting for messages...")
         try:
-            customer_id = json.loads(body)
-            print(f"Received customer ID: {customer_id}")
-            result = process_message(customer_id)
-            print(f"Processed result: {result}")
-
-            # Acknowledge the message after successful processing
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-        except Exception as e:
-            print(f"Error processing message: {e}")
-            # Optionally reject the message and requeue it
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-
-    # Start consuming messages with prefetch to handle load efficiently
-    channel.basic_qos(prefetch_count=1)  # Process one message at a time
-    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback)
-
-    print("Worker started. Waiting for messages...")
+            while not shutdown.is_set():
+                connection.process_data_events(time_limit=1)
+        except KeyboardInterrupt:
+            shutdown.set()
+        logger.info("Worker stopped.")
+        if executor and connection.is_open:
+            # Finish in-flight messages and send their acks before closing
+            channel.stop_consuming()
+            executor.shutdown(wait=True)
+            connection.process_data_events(time_limit=0)
+
+    reporter = start_reporting(metrics)
     try:
-        channel.start_consuming()
+        ReconnectingConsumer(connection_params, consume, metrics, logger, stop=shutdown).run()
     except KeyboardInterrupt:
-        print("Worker stopped.")
+        logger.info("Worker stopped while reconnecting.")
     finally:
-        connection.close()
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if reporter:
+            reporter.stop()
 
 if __name__ == "__main__":
     main()
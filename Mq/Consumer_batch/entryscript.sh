@@ -3,10 +3,10 @@
 # Array to store process PIDs
 pids=()
 
-# Run the worker script as 5 processes
+# Run the worker as 5 processes (WORKER_INDEX offsets each one's METRICS_PORT)
 for i in {1..5}
 do
-   python worker.py &
+   WORKER_INDEX=$((i - 1)) python -m Consumer_batch.worker &
    pids+=($!)  # Store the PID of each background process
 done
 
@@ -27,8 +27,16 @@ handle_exit() {
     exit $exit_code
 }
 
+# Bash runs as PID 1 in the container, so ECS's SIGTERM reaches only this
+# script; pass it on so each worker finishes its current batch, then wait
+forward_signal() {
+    kill -"$1" "${pids[@]}" 2>/dev/null
+    handle_exit
+}
+
 # Set up trap to handle script termination
-trap 'handle_exit' SIGTERM SIGINT
+trap 'forward_signal TERM' SIGTERM
+trap 'forward_signal INT' SIGINT
 
 # Wait for all processes and handle their exit codes
 handle_exit
@@ -1,120 +1,268 @@
 import pika
 import json
 import time
-import ssl
 import os
+import signal
 import threading
-from queue import Empty, Queue
-
-# Retrieve configuration from environment variables
-MQ_HOST = os.getenv("MQ_HOST", "default_host")
-QUEUE_NAME = os.getenv("QUEUE_NAME", "default_queue")
-USERNAME = os.getenv("USERNAME", "default_user")
-PASSWORD = os.getenv("PASSWORD", "default_password")
-
-# Global flag for graceful shutdown
-should_continue = True
-message_processed = threading.Event()
-
-def process_message(body):
-    """Simulate processing"""
-    time.sleep(0.01)  # Simulating 10ms processing delay
-    return {"processed": body}
-
-def check_queue_status(channel, empty_count=0):
-    """Check if queue is empty"""
-    global should_continue
-    
-    if not message_processed.wait(timeout=1.0):  # Wait for 1 second for message processing
-        empty_count += 1
-        if empty_count >= 50:  # Queue empty for 50 consecutive checks
-            print(f"Queue has been empty for {empty_count} consecutive checks. Initiating shutdown...")
-            should_continue = False
-            return
-    else:
-        empty_count = 0  # Reset counter if message was processed
-        message_processed.clear()
-    
-    # Schedule next check
-    if should_continue:
-        threading.Timer(0.1, check_queue_status, args=(channel, empty_count)).start()
 
-def main():
-    global should_continue
-    
-    # Set up credentials and SSL options for secure connection
-    credentials = pika.PlainCredentials(USERNAME, PASSWORD)
-    ssl_context = ssl.create_default_context()
-    ssl_options = pika.SSLOptions(context=ssl_context)
-
-    # Establish connection parameters
-    connection_params = pika.ConnectionParameters(
-        host=MQ_HOST,
-        port=5671,
-        virtual_host="/",
-        credentials=credentials,
-        ssl_options=ssl_options,
-        heartbeat=600,
-        blocked_connection_timeout=300
+from common.config import QUEUE_NAME, connection_parameters
+from common.logs import SampledLogger, setup_logging
+from common.metrics import BacklogGauges, Metrics, start_reporting
+from common.reconnect import ReconnectingConsumer
+from common.retry import RetryPolicy
+
+# A batch is processed once it holds BATCH_SIZE messages or its oldest message
+# has waited BATCH_TIMEOUT_MS; prefetch must exceed the batch size to fill it
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "100"))
+BATCH_TIMEOUT = int(os.getenv("BATCH_TIMEOUT_MS", "200")) / 1000
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", "0")) or BATCH_SIZE * 2
+
+# When to exit: "empty" once no delivery has arrived for IDLE_TIMEOUT seconds
+# and the broker reports no ready messages, "idle" after IDLE_TIMEOUT seconds
+# without deliveries, "never" to keep consuming
+DRAIN_POLICY = os.getenv("DRAIN_POLICY", "empty")
+IDLE_TIMEOUT = float(os.getenv("IDLE_TIMEOUT", "5"))
+DRAIN_CHECK_INTERVAL = float(os.getenv("DRAIN_CHECK_INTERVAL", "1"))  # seconds between passive declares
+
+# Set for a graceful shutdown: on SIGTERM, Ctrl-C or a drained queue
+shutdown = threading.Event()
+
+logger = setup_logging(__name__)
+message_log = SampledLogger(logger)
+metrics = Metrics(labels={"queue": QUEUE_NAME, "worker": "batch_consumer"})
+retry_policy = RetryPolicy(QUEUE_NAME)
+
+def process_messages(bodies):
+    """Process a batch of decoded messages.
+
+    Returns one entry per message, in order; an Exception instance marks
+    that message as failed. Raising fails the whole batch.
+    """
+    time.sleep(0.01)  # Simulating 10ms processing delay per batch round trip
+    return [{"processed": body} for body in bodies]
+
+class MessageBatch:
+    """Deliveries accumulated for one process_messages call"""
+    def __init__(self):
+        self.deliveries = []  # (delivery tag, properties, body)
+        self.started = None
+
+    def add(self, delivery_tag, properties, body):
+        if not self.deliveries:
+            self.started = time.monotonic()
+        self.deliveries.append((delivery_tag, properties, body))
+
+    def is_full(self):
+        return len(self.deliveries) >= BATCH_SIZE
+
+    def is_due(self):
+        return bool(self.deliveries) and time.monotonic() - self.started >= BATCH_TIMEOUT
+
+    def remaining(self):
+        """Seconds until the batch is due, or None while it is empty"""
+        if not self.deliveries:
+            return None
+        return max(0.0, BATCH_TIMEOUT - (time.monotonic() - self.started))
+
+    def take(self):
+        deliveries, self.deliveries, self.started = self.deliveries, [], None
+        return deliveries
+
+def retry_or_dead_letter(channel, properties, body, error):
+    """Republish a failed message to its retry queue or the dead-letter exchange.
+
+    A ValueError (including an undecodable body) will not succeed on another
+    attempt and is dead-lettered at once. The channel is in confirm mode, so
+    this returns once the broker has the copy; the caller then acks the
+    original along with the rest of the batch.
+    """
+    exchange, routing_key, properties.headers, dead = retry_policy.next_destination(
+        properties.headers, error, permanent=isinstance(error, ValueError)
     )
+    channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+    metrics.inc("messages_dead_lettered" if dead else "messages_retried")
+
+def flush_batch(channel, batch):
+    """Process the pending batch and settle it with as few round trips as possible.
+
+    Messages that fail to decode or process are republished to their retry
+    queue (or the dead-letter exchange) first; a single ack with
+    multiple=True on the last delivery tag then settles the whole batch.
+    Each republish is confirmed on its own, so a refused copy requeues only
+    its own message: that tag is nacked before the ack, and the copies the
+    broker did accept are not published a second time.
+    """
+    started = batch.started
+    deliveries = batch.take()
+    if not deliveries:
+        return
+    processing_started = time.monotonic()
+    decoded = []
+    failed = []
+    for delivery_tag, properties, body in deliveries:
+        try:
+            decoded.append((delivery_tag, properties, body, json.loads(body)))
+        except ValueError as e:
+            failed.append((delivery_tag, properties, body, e))
+    try:
+        results = process_messages([message for _, _, _, message in decoded]) if decoded else []
+    except Exception as e:
+        metrics.inc("batches_failed")
+        logger.warning("Error processing batch of %d messages: %s", len(deliveries), e)
+        results = [e] * len(decoded)
+    failed.extend((delivery_tag, properties, body, result)
+                  for (delivery_tag, properties, body, _), result in zip(decoded, results)
+                  if isinstance(result, Exception))
+    refused = []
+    for delivery_tag, properties, body, error in failed:
+        try:
+            retry_or_dead_letter(channel, properties, body, error)
+            message_log.log("Retrying message: %s", error)
+        except (pika.exceptions.NackError, pika.exceptions.UnroutableError) as e:
+            refused.append(delivery_tag)
+            logger.warning("Could not republish a failed message, requeueing it: %s", e)
+    settle(channel, [delivery_tag for delivery_tag, _, _ in deliveries], refused)
+    if failed:
+        logger.warning("%d of %d messages in the batch failed: %s", len(failed), len(deliveries), failed[0][3])
+    now = time.monotonic()
+    metrics.inc("batches")
+    metrics.inc("messages_acked", len(deliveries) - len(failed))
+    metrics.inc("messages_failed", len(failed))
+    if refused:
+        metrics.inc("messages_nacked", len(refused))
+    metrics.observe("batch_processing", now - processing_started)
+    metrics.observe("batch_latency", now - started)  # first delivery to settled
+    message_log.log("Processed batch of %d messages (%d failed)", len(deliveries), len(failed))
 
-    # Connect to RabbitMQ
-    connection = pika.BlockingConnection(connection_params)
-    channel = connection.channel()
+def settle(channel, delivery_tags, refused):
+    """Requeue the refused deliveries one by one, then ack the rest of the
+    batch with one multiple=True ack up to its last acked tag
+    """
+    for delivery_tag in refused:
+        channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+    acked = [delivery_tag for delivery_tag in delivery_tags if delivery_tag not in refused]
+    if acked:
+        channel.basic_ack(delivery_tag=acked[-1], multiple=True)
 
-    # Declare the queue to ensure it exists
-    queue_info = channel.queue_declare(queue=QUEUE_NAME, durable=True)
-    
-    def callback(ch, method, properties, body):
-        """Callback for processing messages"""
+class DrainMonitor:
+    """Decides when the queue is drained, from the connection loop.
+
+    Nothing is checked while deliveries keep arriving. Once the consumer
+    has been idle for IDLE_TIMEOUT seconds the "empty" policy asks the broker
+    for the ready message count with a passive queue_declare, at most every
+    DRAIN_CHECK_INTERVAL seconds. The retry queues count too: a message
+    waiting out its retry delay comes back to the work queue, and would be
+    stranded there if every worker had exited.
+    """
+    def __init__(self, channel, policy=DRAIN_POLICY, idle_timeout=IDLE_TIMEOUT, check_interval=DRAIN_CHECK_INTERVAL,
+                 retry_policy=retry_policy):
+        if policy not in ("empty", "idle", "never"):
+            raise ValueError(f"Unknown DRAIN_POLICY: {policy}")
+        self.channel = channel
+        self.queues = [QUEUE_NAME] + [retry_policy.retry_queue(attempt)
+                                      for attempt in range(1, retry_policy.max_retries + 1)]
+        self.policy = policy
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.last_delivery = time.monotonic()
+        self.last_check = 0.0
+
+    def record_delivery(self):
+        self.last_delivery = time.monotonic()
+
+    def idle_for(self):
+        return time.monotonic() - self.last_delivery
+
+    def is_drained(self):
+        if self.policy == "never" or self.idle_for() < self.idle_timeout:
+            return False
+        if self.policy == "idle":
+            return True
+        if time.monotonic() - self.last_check < self.check_interval:
+            return False
+        self.last_check = time.monotonic()
+        ready = sum(self.channel.queue_declare(queue=queue, passive=True).method.message_count
+                    for queue in self.queues)
+        # A delivery may have arrived while waiting for the declare reply
+        return ready == 0 and self.idle_for() >= self.idle_timeout
+
+def request_shutdown(signum, frame):
+    shutdown.set()
+
+def main():
+    connection_params = connection_parameters(heartbeat=600, blocked_connection_timeout=300)
+
+    # ECS stops tasks with SIGTERM; finish the current batch before exiting
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+    def consume(connection):
+        """One consuming session; ReconnectingConsumer starts a new one if the
+        connection is lost (the unsettled batch is then redelivered)
+        """
+        channel = connection.channel()
+
+        # Declare the queue to ensure it exists
+        channel.queue_declare(queue=QUEUE_NAME, durable=True)
+        retry_policy.declare(channel)
+        channel.confirm_delivery()  # retried and dead-lettered copies are confirmed before the batch is acked
+
+        batch = MessageBatch()
+        drain = DrainMonitor(channel)
+        backlog = BacklogGauges(metrics)
+
+        def sample_queue():
+            """Refresh the backlog gauges from a passive declare"""
+            declared = channel.queue_declare(queue=QUEUE_NAME, passive=True).method
+            backlog.update(declared.message_count, declared.consumer_count)
+
+        def callback(ch, method, properties, body):
+            """Collect deliveries; the batch is processed once full or due"""
+            drain.record_delivery()
+            metrics.inc("messages_received")
+            batch.add(method.delivery_tag, properties, body)
+            if batch.is_full():
+                flush_batch(ch, batch)
+            # While there is a backlog, deliveries are dispatched back to back
+            # without returning to the loop below, so sample from here as well
+            if backlog.due():
+                sample_queue()
+
+        # Keep the next batch arriving while the current one is processed
+        channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+
+        # Start consuming messages
+        channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback)
+
+        logger.info(f"Worker started (batches of up to {BATCH_SIZE} or {BATCH_TIMEOUT * 1000:.0f} ms). "
+                    f"Processing messages...")
         try:
-            customer_id = json.loads(body)
-            print(f"Received customer ID: {customer_id}")
-            result = process_message(customer_id)
-            print(f"Processed result: {result}")
-
-            # Acknowledge the message after successful processing
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            
-            # Signal that a message was processed
-            message_processed.set()
-            
-            if not should_continue:
-                ch.stop_consuming()
-                
-        except Exception as e:
-            print(f"Error processing message: {e}")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-
-    # Configure QoS for optimal performance
-    channel.basic_qos(prefetch_count=10)  # Process up to 10 messages at a time
-    
-    # Start the queue status checker in a separate thread
-    status_checker = threading.Thread(target=check_queue_status, args=(channel,))
-    status_checker.daemon = True
-    status_checker.start()
-
-    # Start consuming messages
-    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback)
-
-    print("Worker started. Processing messages...")
+            while not shutdown.is_set():
+                remaining = batch.remaining()
+                connection.process_data_events(time_limit=0.1 if remaining is None else min(0.1, remaining))
+                if batch.is_due():
+                    flush_batch(channel, batch)
+                if backlog.due():
+                    sample_queue()
+                if not batch.deliveries and drain.is_drained():
+                    logger.info(f"Queue drained (policy {drain.policy}, idle {drain.idle_for():.1f}s). Initiating shutdown...")
+                    shutdown.set()
+
+        except KeyboardInterrupt:
+            logger.info("Received shutdown signal. Initiating graceful shutdown...")
+            shutdown.set()
+
+        if channel.is_open:
+            flush_batch(channel, batch)
+
+    reporter = start_reporting(metrics)
     try:
-        while should_continue:
-            connection.process_data_events(time_limit=0.1)  # Process events with timeout
-            if not should_continue:
-                break
-                
+        ReconnectingConsumer(connection_params, consume, metrics, logger, stop=shutdown).run()
+        logger.info("Connection closed successfully.")
     except KeyboardInterrupt:
-        print("Received shutdown signal. Initiating graceful shutdown...")
-        should_continue = False
-        
+        logger.info("Stopped while reconnecting.")
     finally:
-        try:
-            print("Closing connection...")
-            connection.close()
-            print("Connection closed successfully.")
-        except Exception as e:
-            print(f"Error closing connection: {e}")
+        if reporter:
+            reporter.stop()
 
 if __name__ == "__main__":
     main()
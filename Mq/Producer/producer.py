@@ -1,57 +1,225 @@
-import pika
+import argparse
 import json
-import ssl
-import os
-
-MQ_HOST = os.getenv("MQ_HOST", "default_host")
-QUEUE_NAME = os.getenv("QUEUE_NAME", "default_queue")
-USERNAME = os.getenv("USERNAME", "default_user")
-PASSWORD = os.getenv("PASSWORD", "default_password")
-MQ_HOST = "xxxxxxxx.mq.us-east-1.amazonaws.com"# Replace with your MQ host
-QUEUE_NAME = "oe"
-USERNAME = ""  # Replace with your username
-PASSWORD = "" # Replace with your password
-
-def push_ids_to_queue(customer_ids):
-    # Set up credentials and SSL options
-    credentials = pika.PlainCredentials(USERNAME, PASSWORD)
-    ssl_context = ssl.create_default_context()
-    ssl_options = pika.SSLOptions(context=ssl_context)
-
-    # Establish connection parameters
-    connection_params = pika.ConnectionParameters(
-        host=MQ_HOST,
-        port=5671,  # AMQPS default port
-        virtual_host="/",  # Replace with the appropriate virtual host if needed
-        credentials=credentials,
-        ssl_options=ssl_options
-    )
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pika
+
+from common.config import MQ_HOST, MQ_PORT, QUEUE_NAME, connection_parameters
+from common.metrics import Histogram
+
+PERCENTILES = [50, 95, 99, 99.9]
+
+def iter_messages(start, stop, batch_size):
+    """Yield (message body, ID count) for IDs start..stop-1.
 
-    # Connect to RabbitMQ
-    connection = pika.BlockingConnection(connection_params)
-    channel = connection.channel()
-
-    # Declare the queue
-    channel.queue_declare(queue=QUEUE_NAME, durable=True)
-
-    # Push messages to the queue
-    for customer_id in customer_ids:
-        message = json.dumps(customer_id)
-        channel.basic_publish(
-            exchange='',
-            routing_key=QUEUE_NAME,
-            body=message,
-            properties=pika.BasicProperties(
-                delivery_mode=2  # Make message persistent
-            )
+    With batch_size 1 each body is a single {"id": n} object, as the workers
+    have always received; larger batches send a JSON list of such objects.
+    """
+    for first in range(start, stop, batch_size):
+        ids = [{"id": i} for i in range(first, min(first + batch_size, stop))]
+        body = json.dumps(ids if batch_size > 1 else ids[0])
+        yield body.encode('utf-8'), len(ids)
+
+class ConfirmedPublisher:
+    """Publishes messages over one SelectConnection with pipelined publisher confirms.
+
+    Each channel keeps up to `window` unconfirmed messages outstanding and
+    tops the window up as Basic.Ack/Nack frames arrive (single or multiple),
+    so publishing never waits a full round trip per message. Without
+    confirms, messages are written in window-sized slices between I/O loop
+    iterations.
+    """
+    def __init__(self, parameters, queue, messages, channels=1, window=1000, confirm=True):
+        self.parameters = parameters
+        self.queue = queue
+        self.messages = messages
+        self.channel_count = channels
+        self.window = window
+        self.confirm = confirm
+        self.properties = pika.BasicProperties(delivery_mode=2)  # Make messages persistent
+        self.connection = None
+        self.outstanding = {}  # channel number -> {delivery tag: (publish time, ID count)}
+        self.next_tags = {}
+        self.exhausted = False
+        self.error = None
+        self.published = 0
+        self.published_ids = 0
+        self.confirmed = 0
+        self.nacked = 0
+        self.latency = Histogram()
+
+    def run(self):
+        self.connection = pika.SelectConnection(
+            self.parameters,
+            on_open_callback=self.on_connection_open,
+            on_open_error_callback=self.on_connection_error,
+            on_close_callback=self.on_connection_closed
         )
-        print(f"Pushed customer ID: {customer_id}")
+        self.connection.ioloop.start()
+        if self.error is not None:
+            raise self.error
+
+    def on_connection_open(self, connection):
+        for _ in range(self.channel_count):
+            connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_connection_error(self, connection, error):
+        self.error = error if isinstance(error, Exception) else ConnectionError(str(error))
+        connection.ioloop.stop()
+
+    def on_connection_closed(self, connection, reason):
+        if not isinstance(reason, pika.exceptions.ConnectionClosedByClient):
+            self.error = reason
+        connection.ioloop.stop()
 
-    # Close the connection
-    connection.close()
+    def on_channel_open(self, channel):
+        channel.add_on_close_callback(self.on_channel_closed)
+        self.outstanding[channel.channel_number] = {}
+        self.next_tags[channel.channel_number] = 1
+        channel.queue_declare(queue=self.queue, durable=True,
+                              callback=lambda _frame: self.on_queue_declared(channel))
 
-# Generate test customer IDs
-customer_ids = [{"id": i} for i in range(1000)]
+    def on_channel_closed(self, channel, reason):
+        if not isinstance(reason, pika.exceptions.ChannelClosedByClient) and self.connection.is_open:
+            self.error = reason
+            self.connection.close()
+
+    def on_queue_declared(self, channel):
+        if self.confirm:
+            channel.confirm_delivery(partial(self.on_confirm, channel), callback=lambda _frame: self.publish(channel))
+        else:
+            self.publish(channel)
+
+    def publish(self, channel):
+        pending = self.outstanding[channel.channel_number]
+        sent = 0
+        while not self.exhausted and (len(pending) if self.confirm else sent) < self.window:
+            message = next(self.messages, None)
+            if message is None:
+                self.exhausted = True
+                break
+            body, id_count = message
+            channel.basic_publish(exchange='', routing_key=self.queue, body=body, properties=self.properties)
+            self.published += 1
+            self.published_ids += id_count
+            sent += 1
+            if self.confirm:
+                tag = self.next_tags[channel.channel_number]
+                pending[tag] = (time.perf_counter(), id_count)
+                self.next_tags[channel.channel_number] = tag + 1
+        if not self.confirm and not self.exhausted:
+            # Let the I/O loop flush what was written before producing more
+            self.connection.ioloop.call_later(0, partial(self.publish, channel))
+        self.close_if_done()
+
+    def on_confirm(self, channel, method_frame):
+        method = method_frame.method
+        pending = self.outstanding[channel.channel_number]
+        if method.multiple:
+            tags = [tag for tag in pending if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in pending else []
+        now = time.perf_counter()
+        for tag in tags:
+            sent_at, _ = pending.pop(tag)
+            self.latency.record(now - sent_at)
+            if isinstance(method, pika.spec.Basic.Ack):
+                self.confirmed += 1
+            else:
+                self.nacked += 1
+        self.publish(channel)
+
+    def close_if_done(self):
+        if self.exhausted and not any(self.outstanding.values()) and self.connection.is_open:
+            self.connection.close()
+
+def publish_range(start, stop, batch_size=1, channels=1, window=1000, confirm=True):
+    """Publish IDs start..stop-1 over one connection and return its counters"""
+    publisher = ConfirmedPublisher(
+        connection_parameters(), QUEUE_NAME, iter_messages(start, stop, batch_size), channels, window, confirm
+    )
+    started = time.perf_counter()
+    publisher.run()
+    return {
+        'messages': publisher.published,
+        'ids': publisher.published_ids,
+        'confirmed': publisher.confirmed,
+        'nacked': publisher.nacked,
+        'elapsed_seconds': time.perf_counter() - started,
+        'confirm_latency_counts': dict(publisher.latency.counts),
+    }
+
+def push_ids_to_queue(count, start=0, batch_size=1, connections=1, channels=1, window=1000, confirm=True):
+    """Publish `count` IDs split evenly over `connections` processes.
+
+    Returns the combined report: message and ID rates, confirm counts and
+    confirm latency percentiles.
+    """
+    bounds = [start + count * i // connections for i in range(connections + 1)]
+    started = time.perf_counter()
+    publish = partial(publish_range, batch_size=batch_size, channels=channels, window=window, confirm=confirm)
+    if connections == 1:
+        results = [publish(bounds[0], bounds[1])]
+    else:
+        with ProcessPoolExecutor(max_workers=connections) as executor:
+            results = list(executor.map(publish, bounds[:-1], bounds[1:]))
+    elapsed = time.perf_counter() - started
+
+    latency = Histogram()
+    for result in results:
+        latency.merge(Histogram(result['confirm_latency_counts']))
+    messages = sum(result['messages'] for result in results)
+    ids = sum(result['ids'] for result in results)
+    return {
+        'queue': QUEUE_NAME,
+        'connections': connections,
+        'channels_per_connection': channels,
+        'batch_size': batch_size,
+        'confirm_window': window if confirm else None,
+        'messages': messages,
+        'ids': ids,
+        'confirmed': sum(result['confirmed'] for result in results),
+        'nacked': sum(result['nacked'] for result in results),
+        'elapsed_seconds': round(elapsed, 3),
+        'messages_per_second': round(messages / elapsed, 1) if elapsed > 0 else 0.0,
+        'ids_per_second': round(ids / elapsed, 1) if elapsed > 0 else 0.0,
+        'confirm_latency_ms': latency.summary_ms(PERCENTILES) if confirm else None,
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Publish customer IDs to the RabbitMQ queue")
+    parser.add_argument('--count', type=int, default=1000, help='Number of IDs to publish')
+    parser.add_argument('--start', type=int, default=0, help='First ID')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='IDs per message; above 1 each message body is a JSON list')
+    parser.add_argument('--connections', type=int, default=1, help='Parallel connections, one process each')
+    parser.add_argument('--channels', type=int, default=1, help='Publishing channels per connection')
+    parser.add_argument('--window', type=int, default=1000,
+                        help='Unconfirmed messages allowed in flight per channel')
+    parser.add_argument('--no-confirm', action='store_true', help='Publish without publisher confirms')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    print(f"Publishing {args.count} IDs to {QUEUE_NAME} on {MQ_HOST}:{MQ_PORT} "
+          f"({args.connections} connection(s) x {args.channels} channel(s), {args.batch_size} ID(s) per message)")
+    report = push_ids_to_queue(
+        args.count, args.start, args.batch_size, args.connections, args.channels, args.window,
+        confirm=not args.no_confirm
+    )
+    print(f"Published {report['messages']} messages ({report['ids']} IDs) in {report['elapsed_seconds']:.2f}s: "
+          f"{report['messages_per_second']:.0f} msg/s, {report['ids_per_second']:.0f} IDs/s")
+    if report['confirm_latency_ms']:
+        latency = report['confirm_latency_ms']
+        print(f"Confirmed {report['confirmed']}, nacked {report['nacked']}; confirm latency "
+              f"p50 {latency['p50']:.2f} ms, p99 {latency['p99']:.2f} ms, max {latency['max']:.2f} ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
 
-# Push customer IDs to the queue
-push_ids_to_queue(customer_ids)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import json
+import math
+import time
+
+import pika
+
+from common.config import QUEUE_NAME, connection_parameters
+from common.metrics import scrape_counters
+
+ACKED_METRIC = "mq_messages_acked_total"
+
+def scrape_acked(urls, timeout=5):
+    """Sum the acked-message counters of the workers' /metrics endpoints (None without URLs)"""
+    return scrape_counters(urls, [ACKED_METRIC], timeout)
+
+class QueueSampler:
+    """Ready-message and consumer counts from passive declares on one connection"""
+    def __init__(self, parameters, queue):
+        self.queue = queue
+        self.connection = pika.BlockingConnection(parameters)
+        self.channel = self.connection.channel()
+
+    def sample(self):
+        declared = self.channel.queue_declare(queue=self.queue, passive=True).method
+        return declared.message_count, declared.consumer_count
+
+    def wait(self, seconds):
+        """Sleep while keeping the connection serviced (heartbeats)"""
+        self.connection.sleep(seconds)
+
+    def close(self):
+        if self.connection.is_open:
+            self.connection.close()
+
+def observe(sampler, window, metrics_urls=None):
+    """Sample the queue and the workers' counters `window` seconds apart.
+
+    The drain rate is the acked-message rate scraped from the workers, when
+    their endpoints are given; the arrival rate is the drain rate plus the
+    change in queue depth over the window.
+    """
+    depth_before, _ = sampler.sample()
+    acked_before = scrape_acked(metrics_urls)
+    started = time.monotonic()
+    sampler.wait(window)
+    depth, consumers = sampler.sample()
+    acked = scrape_acked(metrics_urls)
+    elapsed = time.monotonic() - started
+    drain_rate = (acked - acked_before) / elapsed if acked is not None else None
+    return {
+        'queue': sampler.queue,
+        'window_seconds': round(elapsed, 1),
+        'queue_depth_start': depth_before,
+        'queue_depth': depth,
+        'consumers': consumers,
+        'backlog_per_consumer': round(depth / max(consumers, 1), 1),
+        'drain_rate': round(drain_rate, 1) if drain_rate is not None else None,
+        'arrival_rate': round(max(0.0, drain_rate + (depth - depth_before) / elapsed), 1)
+                        if drain_rate is not None else None,
+    }
+
+def decide(observation, per_consumer_rate, target_drain_seconds, consumers_per_task, min_tasks, max_tasks):
+    """Desired consumer and task counts for one observation.
+
+    Consumers must keep up with arrivals and clear the current backlog within
+    target_drain_seconds. Per-consumer throughput is measured from the drain
+    rate while the queue held a backlog through the window (consumers were
+    saturated); otherwise the configured per_consumer_rate is used. Without
+    a measured drain rate, arrivals are taken as the current capacity.
+    """
+    depth = observation['queue_depth']
+    consumers = observation['consumers']
+    drain_rate = observation['drain_rate']
+    saturated = consumers > 0 and depth > 0 and observation['queue_depth_start'] > 0
+    if drain_rate and saturated:
+        per_consumer_rate = drain_rate / consumers
+    arrival_rate = observation['arrival_rate']
+    if arrival_rate is None:
+        arrival_rate = consumers * per_consumer_rate if depth > 0 else 0.0
+    required_rate = arrival_rate + depth / target_drain_seconds
+    desired_consumers = math.ceil(required_rate / per_consumer_rate) if per_consumer_rate > 0 else consumers
+    desired_tasks = min(max_tasks, max(min_tasks, math.ceil(desired_consumers / consumers_per_task)))
+    current_tasks = math.ceil(consumers / consumers_per_task)
+    if desired_tasks > current_tasks:
+        action = 'scale_out'
+    elif desired_tasks < current_tasks:
+        action = 'scale_in'
+    else:
+        action = 'hold'
+    return {
+        **observation,
+        'per_consumer_rate': round(per_consumer_rate, 1),
+        'required_rate': round(required_rate, 1),
+        'desired_consumers': desired_consumers,
+        'current_tasks': current_tasks,
+        'desired_tasks': desired_tasks,
+        'action': action,
+        'timestamp': int(time.time()),
+    }
+
+def to_cloudwatch(decision, namespace):
+    """The decision as a CloudWatch Embedded Metric Format record.
+
+    Printed to stdout of an ECS task using the awslogs driver, it becomes
+    metrics in `namespace` that a target-tracking or step scaling policy
+    can use (e.g. BacklogPerTask against a target).
+    """
+    metrics = {
+        'QueueDepth': (decision['queue_depth'], 'Count'),
+        'Consumers': (decision['consumers'], 'Count'),
+        'BacklogPerConsumer': (decision['backlog_per_consumer'], 'Count'),
+        'BacklogPerTask': (round(decision['queue_depth'] / max(decision['current_tasks'], 1), 1), 'Count'),
+        'DesiredTasks': (decision['desired_tasks'], 'Count'),
+        'PerConsumerRate': (decision['per_consumer_rate'], 'Count/Second'),
+    }
+    if decision['drain_rate'] is not None:
+        metrics['DrainRate'] = (decision['drain_rate'], 'Count/Second')
+        metrics['ArrivalRate'] = (decision['arrival_rate'], 'Count/Second')
+    return {
+        '_aws': {
+            'Timestamp': decision['timestamp'] * 1000,
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [['QueueName']],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()],
+            }],
+        },
+        'QueueName': decision['queue'],
+        'Action': decision['action'],
+        **{name: value for name, (value, _) in metrics.items()},
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compute the desired MQ consumer count from queue depth and drain rate")
+    parser.add_argument('--window', type=float, default=30, help='Seconds between the two queue samples')
+    parser.add_argument('--metrics-url', action='append', default=[],
+                        help='Worker /metrics endpoint to read acked counts from (repeatable)')
+    parser.add_argument('--per-consumer-rate', type=float, default=50,
+                        help='Messages per second one consumer handles when it cannot be measured')
+    parser.add_argument('--target-drain-seconds', type=float, default=300,
+                        help='Time within which the current backlog should be cleared')
+    parser.add_argument('--consumers-per-task', type=int, default=5, help='Worker processes per ECS task')
+    parser.add_argument('--min-tasks', type=int, default=0)
+    parser.add_argument('--max-tasks', type=int, default=20)
+    parser.add_argument('--format', choices=['json', 'cloudwatch'], default='json',
+                        help='Plain decision JSON or a CloudWatch Embedded Metric Format record')
+    parser.add_argument('--namespace', default='SMS/MQ', help='CloudWatch namespace for --format cloudwatch')
+    parser.add_argument('--loop', action='store_true', help='Keep emitting a decision every window')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    sampler = QueueSampler(connection_parameters(), QUEUE_NAME)
+    try:
+        while True:
+            observation = observe(sampler, args.window, args.metrics_url)
+            decision = decide(observation, args.per_consumer_rate, args.target_drain_seconds,
+                              args.consumers_per_task, args.min_tasks, args.max_tasks)
+            record = to_cloudwatch(decision, args.namespace) if args.format == 'cloudwatch' else decision
+            print(json.dumps(record), flush=True)
+            if not args.loop:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sampler.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import os
+import ssl
+
+import pika
+
+# Broker connection settings shared by the producer, the workers and the tools
+MQ_HOST = os.getenv("MQ_HOST", "default_host")
+QUEUE_NAME = os.getenv("QUEUE_NAME", "default_queue")
+USERNAME = os.getenv("USERNAME", "default_user")
+PASSWORD = os.getenv("PASSWORD", "default_password")
+MQ_PORT = int(os.getenv("MQ_PORT", "5671"))  # AMQPS default port
+MQ_TLS = os.getenv("MQ_TLS", "true").lower() in ("1", "true", "yes")  # false for a local broker on 5672
+MQ_VHOST = os.getenv("MQ_VHOST", "/")
+
+def connection_parameters(**kwargs):
+    """pika connection parameters for the configured broker; kwargs (heartbeat, ...) are passed through"""
+    credentials = pika.PlainCredentials(USERNAME, PASSWORD)
+    ssl_options = pika.SSLOptions(context=ssl.create_default_context()) if MQ_TLS else None
+    return pika.ConnectionParameters(
+        host=MQ_HOST,
+        port=MQ_PORT,
+        virtual_host=MQ_VHOST,
+        credentials=credentials,
+        ssl_options=ssl_options,
+        **kwargs
+    )
@@ -0,0 +1,29 @@
+import logging
+import os
+import random
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Fraction of per-message log lines written; they are also only written at LOG_LEVEL=DEBUG
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.001"))
+
+def setup_logging(name):
+    logging.basicConfig(
+        level=LOG_LEVEL.upper(),
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    return logging.getLogger(name)
+
+class SampledLogger:
+    """Per-message logging that is level-gated first and then sampled.
+
+    The level check and the random draw happen before any formatting, so a
+    disabled or unsampled call costs next to nothing on the hot path.
+    """
+    def __init__(self, logger, rate=LOG_SAMPLE_RATE, level=logging.DEBUG):
+        self.logger = logger
+        self.rate = rate
+        self.level = level
+
+    def log(self, msg, *args):
+        if self.rate > 0 and self.logger.isEnabledFor(self.level) and random.random() < self.rate:
+            self.logger.log(self.level, msg, *args)
@@ -0,0 +1,243 @@
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds between summary lines on stdout (0 disables them), and the port of
+# the Prometheus text endpoint (0 disables it; WORKER_INDEX is added so the
+# processes of one container do not collide)
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "10"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+# Seconds between passive queue declares feeding the backlog gauges (0 disables them)
+QUEUE_STATS_INTERVAL = float(os.getenv("QUEUE_STATS_INTERVAL", "10"))
+
+PERCENTILES = [50, 95, 99]
+
+class Histogram:
+    """Microsecond values rounded down to SUB_BITS significant bits (under 1%
+    relative error), so memory depends on the value range, not the count.
+    """
+    SUB_BITS = 8
+
+    def __init__(self, counts=None):
+        self.counts = Counter(counts or {})
+        self.count = sum(self.counts.values())
+        self.sum = sum(value * count for value, count in self.counts.items()) / 1_000_000
+
+    def record(self, seconds):
+        value = int(seconds * 1_000_000)
+        shift = max(0, value.bit_length() - self.SUB_BITS)
+        self.counts[(value >> shift) << shift] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.sum += other.sum
+
+    def percentile(self, percentile):
+        """Value in seconds at the given percentile (0-100)"""
+        if self.count == 0:
+            return 0.0
+        rank = self.count * percentile / 100
+        cumulative = 0
+        for value in sorted(self.counts):
+            cumulative += self.counts[value]
+            if cumulative >= rank:
+                return value / 1_000_000
+        return max(self.counts) / 1_000_000
+
+    def summary_ms(self, percentiles=PERCENTILES):
+        result = {f"p{p:g}": round(self.percentile(p) * 1000, 3) for p in percentiles}
+        result['max'] = round(max(self.counts, default=0) / 1000, 3)
+        return result
+
+class Metrics:
+    """Thread-safe counters, gauges and latency histograms for one process.
+
+    Recording is a dict update under a lock, cheap enough for every message;
+    output happens only in the periodic summary and on scrape.
+    """
+    def __init__(self, prefix="mq", labels=None):
+        self.prefix = prefix
+        self.labels = labels or {}
+        self.counters = Counter()
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.monotonic()
+        self._last_counters = Counter()
+        self._last_snapshot = self.started
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def set(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds)
+
+    def snapshot(self):
+        """Counters with their rate since the previous snapshot, gauges and latency percentiles"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_snapshot
+            counters = dict(self.counters)
+            rates = {
+                name: round((value - self._last_counters[name]) / elapsed, 1) if elapsed > 0 else 0.0
+                for name, value in counters.items()
+            }
+            self._last_counters = Counter(counters)
+            self._last_snapshot = now
+            return {
+                'uptime_seconds': round(now - self.started, 1),
+                'counters': counters,
+                'rates_per_second': rates,
+                'gauges': dict(self.gauges),
+                'latency_ms': {name: histogram.summary_ms() for name, histogram in self.histograms.items()},
+            }
+
+    def prometheus_text(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        labels = ','.join(f'{key}="{value}"' for key, value in sorted(self.labels.items()))
+        def series(name, extra=''):
+            inner = ','.join(part for part in (labels, extra) if part)
+            return f"{self.prefix}_{name}{{{inner}}}" if inner else f"{self.prefix}_{name}"
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines += [f"# TYPE {self.prefix}_{name}_total counter", f"{series(name + '_total')} {value}"]
+            for name, value in sorted(self.gauges.items()):
+                lines += [f"# TYPE {self.prefix}_{name} gauge", f"{series(name)} {value}"]
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{name}_seconds"
+                lines.append(f"# TYPE {self.prefix}_{metric} summary")
+                for p in PERCENTILES:
+                    quantile = 'quantile="%g"' % (p / 100)
+                    lines.append(f"{series(metric, quantile)} {histogram.percentile(p)}")
+                lines += [f"{series(metric + '_sum')} {histogram.sum}", f"{series(metric + '_count')} {histogram.count}"]
+        return '\n'.join(lines) + '\n'
+
+class BacklogGauges:
+    """Autoscaling gauges refreshed from a passive queue_declare.
+
+    Sets queue_depth (ready messages), queue_consumers, backlog_per_consumer
+    and processing_rate, the messages this process acked per second since
+    the previous update. The caller does the declare on its own connection
+    thread, whenever due() says so.
+    """
+    def __init__(self, metrics, interval=QUEUE_STATS_INTERVAL, counter="messages_acked"):
+        self.metrics = metrics
+        self.interval = interval
+        self.counter = counter
+        self.last_update = time.monotonic()
+        self.last_count = 0
+
+    def due(self):
+        return self.interval > 0 and time.monotonic() - self.last_update >= self.interval
+
+    def update(self, message_count, consumer_count):
+        now = time.monotonic()
+        count = self.metrics.counters[self.counter]
+        elapsed = now - self.last_update
+        self.metrics.set("queue_depth", message_count)
+        self.metrics.set("queue_consumers", consumer_count)
+        self.metrics.set("backlog_per_consumer", round(message_count / max(consumer_count, 1), 1))
+        self.metrics.set("processing_rate", round((count - self.last_count) / elapsed, 1) if elapsed > 0 else 0.0)
+        self.last_update = now
+        self.last_count = count
+
+class MetricsReporter(threading.Thread):
+    """Writes a one-line JSON summary of a Metrics registry to stdout every
+    `interval` seconds, and once more when stopped.
+    """
+    def __init__(self, metrics, interval=METRICS_INTERVAL, stream=None):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+    def report(self):
+        line = json.dumps({'metrics': self.metrics.snapshot(), **self.metrics.labels})
+        self.stream.write(line + '\n')
+        self.stream.flush()
+
+    def stop(self):
+        self._stopped.set()
+        self.report()
+
+def serve_prometheus(metrics, port, host="0.0.0.0"):
+    """Serve metrics.prometheus_text() on /metrics from a daemon thread"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def scrape_counters(urls, names, timeout=5):
+    """Sum the series called `names` over the Prometheus text endpoints at `urls`.
+
+    Returns None when no URLs are given; unreachable endpoints count as 0
+    (a stopped worker no longer adds anything).
+    """
+    if not urls:
+        return None
+    names = set(names)
+    total = 0
+    for url in urls:
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                text = response.read().decode('utf-8')
+        except OSError:
+            continue
+        for line in text.splitlines():
+            if line.startswith('#'):
+                continue
+            series, _, value = line.rpartition(' ')
+            if series.split('{', 1)[0] in names:
+                total += float(value)
+    return total
+
+def start_reporting(metrics, interval=METRICS_INTERVAL, port=METRICS_PORT):
+    """Start the periodic summary and, if configured, the Prometheus endpoint.
+
+    Returns the reporter (call stop() on shutdown for a final summary) or None.
+    """
+    if port:
+        serve_prometheus(metrics, port + WORKER_INDEX)
+    if interval <= 0:
+        return None
+    reporter = MetricsReporter(metrics, interval)
+    reporter.start()
+    return reporter
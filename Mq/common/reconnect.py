@@ -0,0 +1,137 @@
+import os
+import random
+import threading
+import time
+
+import pika
+
+# Delay before reconnect attempt n is drawn uniformly from
+# [0, min(RECONNECT_MAX_DELAY, RECONNECT_INITIAL_DELAY * 2 ** (n - 1))] ("full
+# jitter"), so workers that lost the broker together do not return together.
+# RECONNECT_MAX_ATTEMPTS 0 keeps trying until the broker is back.
+RECONNECT_INITIAL_DELAY = float(os.getenv("RECONNECT_INITIAL_DELAY", "1"))
+RECONNECT_MAX_DELAY = float(os.getenv("RECONNECT_MAX_DELAY", "30"))
+RECONNECT_MAX_ATTEMPTS = int(os.getenv("RECONNECT_MAX_ATTEMPTS", "0"))
+
+# Connection and channel failures a new connection can recover from. Closing
+# the connection ourselves ends the session instead, and credentials that
+# the broker rejects are not retried.
+RECOVERABLE_ERRORS = (pika.exceptions.AMQPConnectionError, pika.exceptions.ChannelClosedByBroker,
+                      pika.exceptions.ConsumerCancelled)
+FATAL_ERRORS = (pika.exceptions.ConnectionClosedByClient, pika.exceptions.AuthenticationError,
+                pika.exceptions.ProbableAuthenticationError, pika.exceptions.ProbableAccessDeniedError)
+# Channel closes that a new connection would only run into again:
+# ACCESS_REFUSED, PRECONDITION_FAILED (e.g. a queue redeclared with other
+# arguments), NOT_ALLOWED and NOT_IMPLEMENTED
+FATAL_CHANNEL_CLOSE_CODES = (403, 406, 530, 540)
+
+def is_fatal(error):
+    """True for a broker channel close caused by our own request or permissions"""
+    return isinstance(error, pika.exceptions.ChannelClosedByBroker) and error.reply_code in FATAL_CHANNEL_CLOSE_CODES
+
+def backoff_delay(attempt, initial=RECONNECT_INITIAL_DELAY, maximum=RECONNECT_MAX_DELAY):
+    """Full-jitter exponential backoff for reconnect attempt 1, 2, ..."""
+    return random.uniform(0, min(maximum, initial * 2 ** (attempt - 1)))
+
+class DowntimeTracker:
+    """Reconnect counters for a Metrics registry.
+
+    Sets the `connected` gauge, counts `connection_failures` and `reconnects`,
+    accumulates `downtime_seconds` and records each outage in the
+    `reconnect_downtime` histogram.
+    """
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.down_since = None
+
+    def disconnected(self):
+        if self.down_since is None:
+            self.down_since = time.monotonic()
+            self.metrics.inc("connection_failures")
+        self.metrics.set("connected", 0)
+
+    def connected(self):
+        """Record a (re)connection; returns the length of the outage in seconds, or None"""
+        self.metrics.set("connected", 1)
+        if self.down_since is None:
+            return None
+        downtime = time.monotonic() - self.down_since
+        self.down_since = None
+        self.metrics.inc("reconnects")
+        self.metrics.inc("downtime_seconds", downtime)
+        self.metrics.observe("reconnect_downtime", downtime)
+        return downtime
+
+class ReconnectingConsumer:
+    """Runs a consuming session on a BlockingConnection and starts a new one
+    whenever the connection or channel is lost.
+
+    `session(connection)` declares its topology, consumes, and returns when
+    the worker should stop (drained queue, shutdown signal); a recoverable
+    pika error raised from it, or from connecting, is followed by a jittered
+    backoff and a fresh connection. Unacknowledged messages of the lost
+    connection are redelivered by the broker, so the session must not carry
+    delivery tags across connections.
+
+    Setting `stop` (a threading.Event, e.g. from a SIGTERM handler) ends
+    the loop at the next reconnect, including during a backoff delay, so a
+    worker can be stopped while the broker is down.
+    """
+    def __init__(self, parameters, session, metrics, logger, max_attempts=RECONNECT_MAX_ATTEMPTS, stop=None):
+        self.parameters = parameters
+        self.session = session
+        self.logger = logger
+        self.max_attempts = max_attempts
+        self.stop = stop or threading.Event()
+        self.downtime = DowntimeTracker(metrics)
+
+    def run(self):
+        attempt = 0  # consecutive failures
+        error = None
+        while True:
+            if attempt and not self.wait(attempt, error):
+                self.logger.info("Stopped while reconnecting")
+                return
+            try:
+                connection = pika.BlockingConnection(self.parameters)
+            except FATAL_ERRORS:
+                raise
+            except pika.exceptions.AMQPConnectionError as e:
+                attempt, error = attempt + 1, e
+                continue
+            downtime = self.downtime.connected()
+            if downtime is not None:
+                self.logger.info("Reconnected to %s:%s after %.1fs", self.parameters.host, self.parameters.port, downtime)
+            started = time.monotonic()
+            try:
+                self.session(connection)
+                return
+            except FATAL_ERRORS:
+                raise
+            except RECOVERABLE_ERRORS as e:
+                if is_fatal(e):
+                    raise
+                self.logger.warning("Connection lost: %r", e)
+                self.downtime.disconnected()
+                # A session that stayed up for a while starts the backoff afresh;
+                # one that keeps failing straight away backs off further
+                attempt = 1 if time.monotonic() - started >= RECONNECT_MAX_DELAY else attempt + 1
+                error = e
+            finally:
+                if connection.is_open:
+                    try:
+                        connection.close()
+                    except pika.exceptions.AMQPError:
+                        pass
+
+    def wait(self, attempt, error):
+        """Back off before reconnect attempt `attempt`; returns False if stopped meanwhile"""
+        self.downtime.disconnected()
+        if self.stop.is_set():
+            return False
+        if self.max_attempts and attempt > self.max_attempts:
+            raise error
+        delay = backoff_delay(attempt)
+        self.logger.warning("Reconnecting to %s:%s in %.1fs (attempt %d, after %r)",
+                            self.parameters.host, self.parameters.port, delay, attempt, error)
+        return not self.stop.wait(delay)
@@ -0,0 +1,80 @@
+import os
+
+# Failed messages are retried MAX_RETRIES times, after RETRY_DELAY_MS, then
+# twice that, and so on; after that (or at once, for messages that cannot be
+# decoded) they go to the dead-letter exchange
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "5"))
+RETRY_DELAY_MS = int(os.getenv("RETRY_DELAY_MS", "1000"))
+
+RETRY_COUNT_HEADER = "x-retry-count"
+ERROR_HEADER = "x-last-error"
+MAX_ERROR_LENGTH = 500
+
+class RetryPolicy:
+    """Bounded retries with exponential backoff through TTL queues.
+
+    For queue `q` the topology is:
+
+    - `q.retry.<delay>ms`, one per attempt, with that x-message-ttl and
+      dead-lettering back to `q` on the default exchange, so an expired
+      message returns to the work queue
+    - the direct exchange `q.dlx`, bound to the durable queue `q.dlq` with
+      routing key `q`
+
+    The work queue itself keeps its plain declaration (changing the
+    arguments of an existing queue fails). Workers republish a failed
+    message to its next destination with an incremented x-retry-count
+    header and then ack the original, so a poison message costs at most
+    MAX_RETRIES + 1 attempts.
+    """
+    def __init__(self, queue, max_retries=MAX_RETRIES, base_delay_ms=RETRY_DELAY_MS):
+        self.queue = queue
+        self.max_retries = max_retries
+        self.base_delay_ms = base_delay_ms
+        self.dead_letter_exchange = f"{queue}.dlx"
+        self.dead_letter_queue = f"{queue}.dlq"
+
+    def delay_ms(self, attempt):
+        return self.base_delay_ms * 2 ** (attempt - 1)
+
+    def retry_queue(self, attempt):
+        return f"{self.queue}.retry.{self.delay_ms(attempt)}ms"
+
+    def retry_queue_arguments(self, attempt):
+        return {
+            'x-message-ttl': self.delay_ms(attempt),
+            'x-dead-letter-exchange': '',
+            'x-dead-letter-routing-key': self.queue,
+        }
+
+    def declare(self, channel):
+        """Declare the retry queues and dead-letter exchange on a pika BlockingChannel"""
+        channel.exchange_declare(exchange=self.dead_letter_exchange, exchange_type='direct', durable=True)
+        channel.queue_declare(queue=self.dead_letter_queue, durable=True)
+        channel.queue_bind(queue=self.dead_letter_queue, exchange=self.dead_letter_exchange, routing_key=self.queue)
+        for attempt in range(1, self.max_retries + 1):
+            channel.queue_declare(queue=self.retry_queue(attempt), durable=True,
+                                  arguments=self.retry_queue_arguments(attempt))
+
+    async def declare_async(self, channel):
+        """Declare the same topology on an aio-pika channel"""
+        exchange = await channel.declare_exchange(self.dead_letter_exchange, 'direct', durable=True)
+        dead_letter_queue = await channel.declare_queue(self.dead_letter_queue, durable=True)
+        await dead_letter_queue.bind(exchange, routing_key=self.queue)
+        for attempt in range(1, self.max_retries + 1):
+            await channel.declare_queue(self.retry_queue(attempt), durable=True,
+                                        arguments=self.retry_queue_arguments(attempt))
+
+    def next_destination(self, headers, error, permanent=False):
+        """Where a failed message goes next: (exchange, routing key, new headers, dead-lettered)
+
+        `headers` are the message's current headers (or None); `permanent`
+        skips the retries for errors that cannot succeed on another attempt.
+        """
+        retries = int((headers or {}).get(RETRY_COUNT_HEADER, 0))
+        headers = dict(headers or {})
+        headers[RETRY_COUNT_HEADER] = retries + 1
+        headers[ERROR_HEADER] = str(error)[:MAX_ERROR_LENGTH]
+        if permanent or retries >= self.max_retries:
+            return self.dead_letter_exchange, self.queue, headers, True
+        return '', self.retry_queue(retries + 1), headers, False
@@ -0,0 +1,117 @@
+import argparse
+import json
+import time
+from collections import Counter
+
+import pika
+
+from common.config import QUEUE_NAME, connection_parameters
+from common.retry import ERROR_HEADER, RETRY_COUNT_HEADER, RetryPolicy
+
+def iter_batches(channel, queue, batch_size, limit, idle_timeout):
+    """Consume up to `limit` messages (None for all) from `queue` in lists of up to batch_size.
+
+    Stops once no message has arrived for idle_timeout seconds. Messages
+    are left unacknowledged for the caller.
+    """
+    channel.basic_qos(prefetch_count=batch_size if limit is None else min(batch_size, limit))
+    batch = []
+    taken = 0
+    for method, properties, body in channel.consume(queue, inactivity_timeout=idle_timeout):
+        if method is not None:
+            batch.append((method, properties, body))
+            taken += 1
+        if batch and (method is None or len(batch) >= batch_size or taken == limit):
+            yield batch
+            batch = []
+        if method is None or taken == limit:
+            break
+    channel.cancel()
+
+def replay(channel, source, target, batch_size=500, limit=None, idle_timeout=1.0, reset_retries=True):
+    """Move messages from the dead-letter queue `source` back to `target`.
+
+    Each batch is republished and acknowledged in one AMQP transaction, so
+    an interrupted replay leaves every batch either moved or still in the
+    dead-letter queue. The
+    retry count is reset unless reset_retries is False (a message then goes
+    straight back to the dead-letter queue on its next failure).
+    """
+    channel.tx_select()
+    replayed = 0
+    for batch in iter_batches(channel, source, batch_size, limit, idle_timeout):
+        for _, properties, body in batch:
+            headers = dict(properties.headers or {})
+            if reset_retries:
+                headers.pop(RETRY_COUNT_HEADER, None)
+            headers.pop('x-death', None)
+            properties.headers = headers
+            channel.basic_publish(exchange='', routing_key=target, body=body, properties=properties)
+        channel.basic_ack(delivery_tag=batch[-1][0].delivery_tag, multiple=True)
+        channel.tx_commit()
+        replayed += len(batch)
+    return replayed
+
+def inspect(channel, source, limit=None, samples=5):
+    """Summarise dead-lettered messages without removing them.
+
+    Messages are fetched with basic.get and never acknowledged, so they
+    return to the queue when the channel closes.
+    """
+    errors = Counter()
+    retries = Counter()
+    examples = []
+    count = 0
+    while limit is None or count < limit:
+        method, properties, body = channel.basic_get(source)
+        if method is None:
+            break
+        headers = properties.headers or {}
+        errors[str(headers.get(ERROR_HEADER, 'unknown'))] += 1
+        retries[int(headers.get(RETRY_COUNT_HEADER, 0))] += 1
+        if len(examples) < samples:
+            examples.append(body.decode('utf-8', 'replace')[:200])
+        count += 1
+    return {
+        'messages': count,
+        'errors': dict(errors.most_common(10)),
+        'retry_counts': dict(sorted(retries.items())),
+        'examples': examples,
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inspect or replay the dead-letter queue of the worker queue")
+    parser.add_argument('--queue', default=QUEUE_NAME, help='Work queue whose dead-letter queue is read')
+    parser.add_argument('--target', help='Queue to replay into (defaults to --queue)')
+    parser.add_argument('--limit', type=int, help='Replay at most this many messages')
+    parser.add_argument('--batch-size', type=int, default=500, help='Messages per transaction')
+    parser.add_argument('--idle-timeout', type=float, default=1.0,
+                        help='Stop after this many seconds without a message')
+    parser.add_argument('--keep-retry-count', action='store_true',
+                        help='Keep the x-retry-count header instead of granting a fresh set of retries')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Summarise the dead-lettered messages (or the first --limit) and leave them in place')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    source = RetryPolicy(args.queue).dead_letter_queue
+    connection = pika.BlockingConnection(connection_parameters())
+    channel = connection.channel()
+    try:
+        waiting = channel.queue_declare(queue=source, passive=True).method.message_count
+        print(f"{waiting} message(s) in {source}")
+        if args.dry_run:
+            print(json.dumps(inspect(channel, source, args.limit), indent=2))
+            return
+        started = time.perf_counter()
+        replayed = replay(channel, source, args.target or args.queue, args.batch_size, args.limit,
+                          args.idle_timeout, reset_retries=not args.keep_retry_count)
+        elapsed = time.perf_counter() - started
+        print(f"Replayed {replayed} message(s) to {args.target or args.queue} in {elapsed:.2f}s")
+    finally:
+        if connection.is_open:
+            connection.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+import argparse
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+
+from pika import frame, spec
+
+FRAME_MAX = 131072
+FRAME_OVERHEAD = 8  # type, channel, size and frame-end octets
+
+class Message:
+    def __init__(self, exchange, routing_key, properties, body):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.properties = properties
+        self.body = body
+        self.redelivered = False
+        self.expires_at = None
+
+class MockQueue:
+    def __init__(self, name, arguments=None):
+        self.name = name
+        self.arguments = arguments or {}
+        self.messages = deque()
+        self.consumers = deque()
+
+    @property
+    def ttl(self):
+        ttl = self.arguments.get('x-message-ttl')
+        return ttl / 1000 if ttl is not None else None
+
+class Consumer:
+    def __init__(self, channel, tag, queue, no_ack):
+        self.channel = channel
+        self.tag = tag
+        self.queue = queue
+        self.no_ack = no_ack
+
+class ChannelState:
+    def __init__(self, number):
+        self.number = number
+        self.prefetch = 0
+        self.confirm = False
+        self.publish_tag = 0
+        self.delivery_tags = itertools.count(1)
+        self.unacked = {}  # delivery tag -> (queue, message)
+        self.consumers = {}
+        self.pending = None  # (Basic.Publish, properties, body size, body parts) being assembled
+        self.transaction = None  # publishes and settlements deferred until Tx.Commit, once Tx.Select is sent
+
+    def has_capacity(self):
+        return self.prefetch == 0 or len(self.unacked) < self.prefetch
+
+class MockBroker:
+    """In-process stand-in for RabbitMQ / Amazon MQ speaking enough AMQP 0-9-1
+    for the producer and workers: queues on the default exchange, direct and
+    fanout exchanges, publisher confirms, prefetch, acks/nacks with requeue,
+    passive declares, basic.get, per-queue/per-message TTL, dead-lettering and
+    transactions.
+
+    Nothing is persisted and authentication always succeeds.
+    """
+    def __init__(self):
+        self.queues = {}
+        self.exchanges = {'': ('direct', {}), 'amq.direct': ('direct', {})}  # name -> (type, bindings)
+        self.published = 0
+        self.delivered = 0
+        self.connections = 0
+
+    # Routing
+
+    def route(self, exchange, routing_key, properties, body):
+        if exchange == '':
+            names = [routing_key] if routing_key in self.queues else []
+        else:
+            kind, bindings = self.exchanges.get(exchange, ('direct', {}))
+            if kind == 'fanout':
+                names = sorted({name for keys in bindings.values() for name in keys})
+            else:
+                names = sorted(bindings.get(routing_key, ()))
+        for name in names:
+            self.enqueue(self.queues[name], Message(exchange, routing_key, properties, body))
+
+    def enqueue(self, queue, message, front=False):
+        ttl = queue.ttl
+        if properties_expiration(message.properties) is not None:
+            ttl = min(ttl if ttl is not None else float('inf'), properties_expiration(message.properties))
+        if ttl is not None and not front:
+            message.expires_at = time.monotonic() + ttl
+            asyncio.get_running_loop().call_later(ttl, self.expire, queue)
+        if front:
+            queue.messages.appendleft(message)
+        else:
+            queue.messages.append(message)
+        self.dispatch(queue)
+
+    def expire(self, queue):
+        """Dead-letter expired messages from the head of the queue, as RabbitMQ does"""
+        now = time.monotonic()
+        while queue.messages and queue.messages[0].expires_at is not None and queue.messages[0].expires_at <= now:
+            self.dead_letter(queue, queue.messages.popleft(), 'expired')
+
+    def dead_letter(self, queue, message, reason):
+        exchange = queue.arguments.get('x-dead-letter-exchange')
+        if exchange is None:
+            return
+        routing_key = queue.arguments.get('x-dead-letter-routing-key', message.routing_key)
+        properties = message.properties
+        headers = dict(properties.headers or {})
+        deaths = list(headers.get('x-death') or [])
+        deaths.insert(0, {'queue': queue.name, 'reason': reason, 'exchange': message.exchange,
+                          'routing-keys': [message.routing_key]})
+        headers['x-death'] = deaths
+        dead = spec.BasicProperties(
+            content_type=properties.content_type, delivery_mode=properties.delivery_mode,
+            headers=headers, message_id=properties.message_id, timestamp=properties.timestamp,
+        )
+        self.route(exchange, routing_key, dead, message.body)
+
+    def dispatch(self, queue):
+        """Hand queued messages to consumers with free prefetch capacity, round-robin"""
+        self.expire(queue)
+        while queue.messages and queue.consumers:
+            for _ in range(len(queue.consumers)):
+                consumer = queue.consumers[0]
+                queue.consumers.rotate(-1)
+                if consumer.no_ack or consumer.channel.state.has_capacity():
+                    break
+            else:
+                return
+            message = queue.messages.popleft()
+            consumer.channel.deliver(consumer, message)
+
+    # Queue operations shared by connections
+
+    def requeue(self, queue, message):
+        message.redelivered = True
+        self.enqueue(queue, message, front=True)
+
+    def remove_consumer(self, consumer):
+        if consumer in consumer.queue.consumers:
+            consumer.queue.consumers.remove(consumer)
+
+    # Server
+
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        connection = BrokerConnection(self, reader, writer)
+        try:
+            await connection.run()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            connection.release()
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=5672, ready=None):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        if ready is not None:
+            ready(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+def properties_expiration(properties):
+    if properties is None or properties.expiration is None:
+        return None
+    return int(properties.expiration) / 1000
+
+class BrokerChannel:
+    def __init__(self, connection, number):
+        self.connection = connection
+        self.state = ChannelState(number)
+
+    @property
+    def broker(self):
+        return self.connection.broker
+
+    def deliver(self, consumer, message):
+        delivery_tag = next(self.state.delivery_tags)
+        if not consumer.no_ack:
+            self.state.unacked[delivery_tag] = (consumer.queue, message)
+        self.broker.delivered += 1
+        self.connection.send_content(self.state.number, spec.Basic.Deliver(
+            consumer.tag, delivery_tag, message.redelivered, message.exchange, message.routing_key
+        ), message.properties, message.body)
+
+    def settle(self, delivery_tag, multiple, action):
+        """Ack, requeue or dead-letter unacknowledged deliveries"""
+        if multiple:
+            tags = [tag for tag in self.state.unacked if tag <= delivery_tag or delivery_tag == 0]
+        else:
+            tags = [delivery_tag] if delivery_tag in self.state.unacked else []
+        if not tags:
+            self.connection.close_channel(self.state.number, 406, f"PRECONDITION_FAILED - unknown delivery tag {delivery_tag}")
+            return
+        queues = set()
+        # Requeued messages go back to the head of the queue in their original order
+        for tag in sorted(tags, reverse=action == 'requeue'):
+            queue, message = self.state.unacked.pop(tag)
+            queues.add(queue.name)
+            if action == 'requeue':
+                self.broker.requeue(queue, message)
+            elif action == 'reject':
+                self.broker.dead_letter(queue, message, 'rejected')
+        for name in self.consumed_queues() | queues:
+            if name in self.broker.queues:
+                self.broker.dispatch(self.broker.queues[name])
+
+    def consumed_queues(self):
+        return {consumer.queue.name for consumer in self.state.consumers.values()}
+
+    def release(self):
+        """Requeue everything unacknowledged and drop this channel's consumers"""
+        for consumer in self.state.consumers.values():
+            self.broker.remove_consumer(consumer)
+        self.state.consumers.clear()
+        unacked = sorted(self.state.unacked.items(), reverse=True)
+        self.state.unacked.clear()
+        for _, (queue, message) in unacked:
+            self.broker.requeue(queue, message)
+
+    def handle_method(self, method):
+        broker = self.broker
+        send = lambda reply: self.connection.send_method(self.state.number, reply)
+        if isinstance(method, spec.Channel.Close):
+            self.release()
+            send(spec.Channel.CloseOk())
+            self.connection.channels.pop(self.state.number, None)
+        elif isinstance(method, spec.Channel.CloseOk):
+            self.connection.channels.pop(self.state.number, None)
+        elif isinstance(method, spec.Exchange.Declare):
+            if method.passive and method.exchange not in broker.exchanges:
+                return self.connection.close_channel(self.state.number, 404, f"NOT_FOUND - no exchange '{method.exchange}'")
+            broker.exchanges.setdefault(method.exchange, (method.type, {}))
+            if not method.nowait:
+                send(spec.Exchange.DeclareOk())
+        elif isinstance(method, spec.Queue.Declare):
+            name = method.queue or f"amq.gen-{id(self):x}-{len(broker.queues)}"
+            if method.passive and name not in broker.queues:
+                return self.connection.close_channel(self.state.number, 404, f"NOT_FOUND - no queue '{name}'")
+            queue = broker.queues.setdefault(name, MockQueue(name, dict(method.arguments or {})))
+            if not method.nowait:
+                send(spec.Queue.DeclareOk(name, len(queue.messages), len(queue.consumers)))
+        elif isinstance(method, spec.Queue.Bind):
+            if method.exchange not in broker.exchanges or method.queue not in broker.queues:
+                return self.connection.close_channel(self.state.number, 404, "NOT_FOUND - no exchange or queue")
+            broker.exchanges[method.exchange][1].setdefault(method.routing_key, set()).add(method.queue)
+            if not method.nowait:
+                send(spec.Queue.BindOk())
+        elif isinstance(method, spec.Queue.Purge):
+            queue = broker.queues.get(method.queue)
+            count = len(queue.messages) if queue else 0
+            if queue:
+                queue.messages.clear()
+            if not method.nowait:
+                send(spec.Queue.PurgeOk(count))
+        elif isinstance(method, spec.Queue.Delete):
+            queue = broker.queues.pop(method.queue, None)
+            if not method.nowait:
+                send(spec.Queue.DeleteOk(len(queue.messages) if queue else 0))
+        elif isinstance(method, spec.Basic.Qos):
+            self.state.prefetch = method.prefetch_count
+            send(spec.Basic.QosOk())
+        elif isinstance(method, spec.Confirm.Select):
+            self.state.confirm = True
+            if not method.nowait:
+                send(spec.Confirm.SelectOk())
+        elif isinstance(method, spec.Basic.Consume):
+            queue = broker.queues.get(method.queue)
+            if queue is None:
+                return self.connection.close_channel(self.state.number, 404, f"NOT_FOUND - no queue '{method.queue}'")
+            tag = method.consumer_tag or f"ctag-{id(self):x}-{len(self.state.consumers)}"
+            consumer = Consumer(self, tag, queue, method.no_ack)
+            self.state.consumers[tag] = consumer
+            if not method.nowait:
+                send(spec.Basic.ConsumeOk(tag))
+            queue.consumers.append(consumer)
+            broker.dispatch(queue)
+        elif isinstance(method, spec.Basic.Cancel):
+            consumer = self.state.consumers.pop(method.consumer_tag, None)
+            if consumer:
+                broker.remove_consumer(consumer)
+            if not method.nowait:
+                send(spec.Basic.CancelOk(method.consumer_tag))
+        elif isinstance(method, spec.Basic.Get):
+            queue = broker.queues.get(method.queue)
+            if queue is None:
+                return self.connection.close_channel(self.state.number, 404, f"NOT_FOUND - no queue '{method.queue}'")
+            broker.expire(queue)
+            if not queue.messages:
+                return send(spec.Basic.GetEmpty())
+            message = queue.messages.popleft()
+            delivery_tag = next(self.state.delivery_tags)
+            if not method.no_ack:
+                self.state.unacked[delivery_tag] = (queue, message)
+            self.connection.send_content(self.state.number, spec.Basic.GetOk(
+                delivery_tag, message.redelivered, message.exchange, message.routing_key, len(queue.messages)
+            ), message.properties, message.body)
+        elif isinstance(method, spec.Basic.Ack):
+            self.defer(self.settle, method.delivery_tag, method.multiple, 'ack')
+        elif isinstance(method, spec.Basic.Nack):
+            self.defer(self.settle, method.delivery_tag, method.multiple, 'requeue' if method.requeue else 'reject')
+        elif isinstance(method, spec.Basic.Reject):
+            self.defer(self.settle, method.delivery_tag, False, 'requeue' if method.requeue else 'reject')
+        elif isinstance(method, spec.Tx.Select):
+            self.state.transaction = []
+            send(spec.Tx.SelectOk())
+        elif isinstance(method, (spec.Tx.Commit, spec.Tx.Rollback)):
+            if self.state.transaction is None:
+                return self.connection.close_channel(self.state.number, 406, "PRECONDITION_FAILED - channel is not transactional")
+            operations, self.state.transaction = self.state.transaction, []
+            if isinstance(method, spec.Tx.Commit):
+                for operation in operations:
+                    operation()
+                send(spec.Tx.CommitOk())
+            else:
+                send(spec.Tx.RollbackOk())
+        elif isinstance(method, spec.Basic.Publish):
+            self.state.pending = (method, None, 0, [])
+        else:
+            self.connection.close_channel(self.state.number, 540, f"NOT_IMPLEMENTED - {method.NAME}")
+
+    def defer(self, operation, *args):
+        """Run now, or at Tx.Commit on a transactional channel"""
+        if self.state.transaction is None:
+            operation(*args)
+        else:
+            self.state.transaction.append(lambda: operation(*args))
+
+    def handle_header(self, header):
+        method, _, _, parts = self.state.pending
+        self.state.pending = (method, header.properties, header.body_size, parts)
+        if header.body_size == 0:
+            self.finish_publish()
+
+    def handle_body(self, body):
+        method, properties, size, parts = self.state.pending
+        parts.append(body.fragment)
+        if sum(len(part) for part in parts) >= size:
+            self.finish_publish()
+
+    def finish_publish(self):
+        method, properties, _, parts = self.state.pending
+        self.state.pending = None
+        self.broker.published += 1
+        self.defer(self.broker.route, method.exchange, method.routing_key, properties, b''.join(parts))
+        if self.state.confirm:
+            self.state.publish_tag += 1
+            self.connection.send_method(self.state.number, spec.Basic.Ack(self.state.publish_tag))
+
+class BrokerConnection:
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.channels = {}
+        self.frame_max = FRAME_MAX
+        self.heartbeat_task = None
+        self.closed = False
+
+    def send_method(self, channel_number, method):
+        self.writer.write(frame.Method(channel_number, method).marshal())
+
+    def send_content(self, channel_number, method, properties, body):
+        properties = properties or spec.BasicProperties()
+        self.send_method(channel_number, method)
+        self.writer.write(frame.Header(channel_number, len(body), properties).marshal())
+        chunk = self.frame_max - FRAME_OVERHEAD
+        for offset in range(0, len(body), chunk):
+            self.writer.write(frame.Body(channel_number, body[offset:offset + chunk]).marshal())
+
+    def close_channel(self, number, code, text):
+        channel = self.channels.get(number)
+        if channel:
+            channel.release()
+        self.send_method(number, spec.Channel.Close(code, text, 0, 0))
+
+    def release(self):
+        self.closed = True
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+        for channel in list(self.channels.values()):
+            channel.release()
+        self.channels.clear()
+
+    async def send_heartbeats(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.writer.write(frame.Heartbeat().marshal())
+
+    async def run(self):
+        await self.reader.readexactly(8)  # protocol header
+        self.send_method(0, spec.Connection.Start(server_properties={
+            'product': 'mock_broker',
+            'capabilities': {
+                'publisher_confirms': True,
+                'basic.nack': True,
+                'consumer_cancel_notify': True,
+                'exchange_exchange_bindings': False,
+                'per_consumer_qos': True,
+            },
+        }))
+        buffer = b''
+        while not self.closed:
+            data = await self.reader.read(65536)
+            if not data:
+                return
+            buffer += data
+            while True:
+                consumed, received = frame.decode_frame(buffer)
+                if not consumed:
+                    break
+                buffer = buffer[consumed:]
+                self.handle_frame(received)
+            await self.writer.drain()
+
+    def handle_frame(self, received):
+        if isinstance(received, frame.Heartbeat):
+            return
+        channel = self.channels.get(received.channel_number)
+        if isinstance(received, frame.Method) and received.channel_number == 0:
+            self.handle_connection_method(received.method)
+        elif isinstance(received, frame.Method) and isinstance(received.method, spec.Channel.Open):
+            self.channels[received.channel_number] = BrokerChannel(self, received.channel_number)
+            self.send_method(received.channel_number, spec.Channel.OpenOk())
+        elif channel is None:
+            return
+        elif isinstance(received, frame.Method):
+            channel.handle_method(received.method)
+        elif isinstance(received, frame.Header):
+            channel.handle_header(received)
+        elif isinstance(received, frame.Body):
+            channel.handle_body(received)
+
+    def handle_connection_method(self, method):
+        if isinstance(method, spec.Connection.StartOk):
+            self.send_method(0, spec.Connection.Tune(channel_max=2047, frame_max=FRAME_MAX, heartbeat=0))
+        elif isinstance(method, spec.Connection.TuneOk):
+            self.frame_max = method.frame_max or FRAME_MAX
+            if method.heartbeat:
+                self.heartbeat_task = asyncio.get_running_loop().create_task(self.send_heartbeats(method.heartbeat / 2))
+        elif isinstance(method, spec.Connection.Open):
+            self.send_method(0, spec.Connection.OpenOk())
+        elif isinstance(method, spec.Connection.Close):
+            self.send_method(0, spec.Connection.CloseOk())
+            self.closed = True
+        elif isinstance(method, spec.Connection.CloseOk):
+            self.closed = True
+
+def start_in_thread(broker, host='127.0.0.1', port=0):
+    """Run a MockBroker on a daemon thread and return the port it listens on.
+
+    Port 0 picks a free port.
+    """
+    bound = {}
+    started = threading.Event()
+
+    def ready(actual_port):
+        bound['port'] = actual_port
+        started.set()
+
+    thread = threading.Thread(target=lambda: asyncio.run(broker.serve(host, port, ready)), daemon=True)
+    thread.start()
+    if not started.wait(timeout=10):
+        raise RuntimeError("Mock AMQP broker did not start")
+    return bound['port']
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local in-memory AMQP 0-9-1 broker for testing the MQ scripts")
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=5672, help='Port to listen on')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    broker = MockBroker()
+    print(f"Mock AMQP broker on amqp://{args.host}:{args.port} "
+          f"(connect with MQ_HOST={args.host} MQ_PORT={args.port} MQ_TLS=false)")
+    try:
+        asyncio.run(broker.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print(f"Stopped. Published {broker.published}, delivered {broker.delivered}, "
+              f"queues: { {name: len(queue.messages) for name, queue in broker.queues.items()} }")